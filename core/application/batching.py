@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, TypeVar
+
+from core.application.metrics import MetricsRecorder, NullMetrics
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class DynamicBatcher(Generic[T, R]):
+    """
+    Собирает запросы из разных потоков в пачки и обрабатывает их одним вызовом process_batch в своём потоке.
+    Пачка отправляется, когда набралось max_batch_size запросов или первый запрос ждёт max_wait секунд.
+    process_batch возвращает результат или исключение для каждого запроса в том же порядке
+    """
+
+    def __init__(
+            self,
+            name: str,
+            process_batch: Callable[[list[T]], list[R | Exception]],
+            max_batch_size: int = 4,
+            max_wait: float = 0.05,
+            metrics: MetricsRecorder | None = None,
+    ):
+        self.name = name
+        self._process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._metrics = metrics or NullMetrics()
+        self._pending: list[tuple[T, Future]] = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._work, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, request: T) -> Future:
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(f"Очередь {self.name} закрыта")
+            self._pending.append((request, future))
+            self._metrics.set_queue_depth(self.name, len(self._pending))
+            self._condition.notify()
+        return future
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _work(self):
+        while (batch := self._next_batch()) is not None:
+            requests = [request for request, _ in batch]
+            try:
+                results = self._process_batch(requests)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _next_batch(self) -> list[tuple[T, Future]] | None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed)
+            if not self._pending:
+                return None
+            # Первый запрос уже есть, ждём попутчиков, но не дольше max_wait
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            self._metrics.set_queue_depth(self.name, len(self._pending))
+            return batch
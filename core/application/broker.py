@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Collection, Protocol
+
+from core.application.dto import AudioPath, ImagePath
+from core.application.job import Stage
+
+
+class TaskState(str, Enum):
+    # Ждёт стадии, от которых зависит
+    WAITING = "waiting"
+    READY = "ready"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass(slots=True, frozen=True)
+class JobInputs:
+    audio: AudioPath
+    song_title: str
+    cover_image: ImagePath
+
+
+@dataclass(slots=True, frozen=True)
+class LeasedTask:
+    job_id: str
+    stage: Stage
+    attempt: int
+    inputs: JobInputs
+
+
+class Broker(Protocol):
+    """
+    Раздаёт стадии задач исполнителям на других машинах. Исполнитель берёт стадию в аренду,
+    продлевает аренду, пока работает, и возвращает результаты стадии. Стадия, аренда которой истекла
+    или которая завершилась ошибкой, выдаётся снова, пока не кончатся попытки
+    """
+
+    def submit(self, job_id: str, inputs: JobInputs, stages: tuple[Stage, ...],
+               completed: dict[Stage, Path] | None = None) -> None:
+        """
+        Ставит задачу в очередь. completed - папки с результатами уже выполненных стадий, они не выполняются заново.
+        Повторная постановка выполняющейся или готовой задачи ничего не делает
+        """
+
+    def lease(self, worker_id: str, stages: Collection[Stage], lease_seconds: float) -> LeasedTask | None:
+        """
+        Берёт в аренду готовую к выполнению стадию одного из видов stages или возвращает None
+        """
+
+    def heartbeat(self, task: LeasedTask, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Продлевает аренду. False, если аренда уже потеряна и стадию выполняет кто-то другой
+        """
+
+    def complete(self, task: LeasedTask, worker_id: str, artifacts: Path) -> None:
+        """
+        Сохраняет результаты стадии из папки artifacts и открывает зависящие от неё стадии
+        """
+
+    def fail(self, task: LeasedTask, worker_id: str, error: str) -> None:
+        ...
+
+    def status(self, job_id: str) -> dict[Stage, TaskState]:
+        ...
+
+    def error(self, job_id: str) -> str | None:
+        """
+        Последняя ошибка задачи, если какая-то её стадия окончательно не удалась
+        """
+
+    def fetch_artifacts(self, job_id: str, stage: Stage, destination: Path) -> None:
+        """
+        Копирует результаты выполненной стадии в папку destination
+        """
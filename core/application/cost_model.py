@@ -0,0 +1,123 @@
+import threading
+from collections import defaultdict
+from dataclasses import astuple, dataclass
+from typing import Protocol
+
+import numpy as np
+
+from core.application.job import Job, Stage
+
+# Оценка до накопления истории: секунд работы стадии на секунду аудио
+DEFAULT_SECONDS_PER_AUDIO_SECOND: dict[Stage, float] = {
+    Stage.TEXT: 0.01,
+    Stage.SEPARATION: 0.3,
+    Stage.RECOGNITION: 1.5,
+    Stage.LINKING: 0.05,
+    Stage.PREVIEW: 0.5,
+    Stage.RENDERING: 1.5,
+}
+# Длительность песни, если её не удалось определить, секунды
+DEFAULT_AUDIO_DURATION = 210.0
+
+
+@dataclass(slots=True, frozen=True)
+class JobFeatures:
+    audio_duration: float | None = None
+    lyric_chars: int | None = None
+    word_count: int | None = None
+
+    @classmethod
+    def of(cls, job: Job) -> "JobFeatures":
+        """
+        Признаки задачи. Текст песни известен, только если стадия получения текста уже выполнена
+        """
+        text = job.checkpoint.load(Stage.TEXT)
+        if text is None:
+            return cls(job.audio_duration)
+        return cls(job.audio_duration, len(text), len(text.split()))
+
+
+@dataclass(slots=True, frozen=True)
+class TimingSample:
+    stage: Stage
+    features: JobFeatures
+    seconds: float
+
+
+class TimingHistory(Protocol):
+    def append(self, sample: TimingSample) -> None:
+        """
+        Сохраняет время выполнения стадии
+        """
+
+    def load(self) -> list[TimingSample]:
+        """
+        Все сохранённые замеры в порядке записи
+        """
+
+
+class InMemoryTimingHistory(TimingHistory):
+    def __init__(self):
+        self._samples: list[TimingSample] = []
+
+    def append(self, sample: TimingSample) -> None:
+        self._samples.append(sample)
+
+    def load(self) -> list[TimingSample]:
+        return list(self._samples)
+
+
+class CostModel:
+    """
+    Время стадии как линейная функция признаков задачи, коэффициенты подбираются методом наименьших квадратов
+    по последним замерам. Неизвестные признаки заменяются средними по замерам.
+    Пока замеров мало, время считается пропорциональным длительности аудио
+    """
+    MIN_SAMPLES = 8
+    MAX_SAMPLES = 500
+
+    def __init__(self, history: TimingHistory | None = None):
+        self.history = history or InMemoryTimingHistory()
+        self._lock = threading.Lock()
+        self._samples: dict[Stage, list[TimingSample]] = defaultdict(list)
+        self._fits: dict[Stage, tuple[np.ndarray, np.ndarray]] = {}
+        for sample in self.history.load():
+            self._samples[sample.stage].append(sample)
+        for stage in list(self._samples):
+            self._samples[stage] = self._samples[stage][-self.MAX_SAMPLES:]
+            self._fit(stage)
+
+    def record(self, stage: Stage, features: JobFeatures, seconds: float) -> None:
+        sample = TimingSample(stage, features, seconds)
+        self.history.append(sample)
+        with self._lock:
+            samples = self._samples[stage]
+            samples.append(sample)
+            del samples[:-self.MAX_SAMPLES]
+            self._fit(stage)
+
+    def predict(self, stage: Stage, features: JobFeatures) -> float:
+        with self._lock:
+            fit = self._fits.get(stage)
+        if fit is None:
+            duration = features.audio_duration or DEFAULT_AUDIO_DURATION
+            return DEFAULT_SECONDS_PER_AUDIO_SECOND[stage] * duration
+        coefficients, means = fit
+        design = self._design(np.array([astuple(features)], dtype=np.float64), means)
+        return max(float(design @ coefficients), 0.0)
+
+    def _fit(self, stage: Stage):
+        samples = self._samples[stage]
+        if len(samples) < self.MIN_SAMPLES:
+            return
+        rows = np.array([astuple(sample.features) for sample in samples], dtype=np.float64)
+        known = ~np.isnan(rows)
+        means = np.where(known.any(axis=0), np.nansum(rows, axis=0) / np.maximum(known.sum(axis=0), 1), 0.0)
+        seconds = np.fromiter((sample.seconds for sample in samples), dtype=np.float64, count=len(samples))
+        coefficients, *_ = np.linalg.lstsq(self._design(rows, means), seconds, rcond=None)
+        self._fits[stage] = (coefficients, means)
+
+    @staticmethod
+    def _design(rows: np.ndarray, means: np.ndarray) -> np.ndarray:
+        filled = np.where(np.isnan(rows), means, rows)
+        return np.hstack([np.ones((len(rows), 1)), filled])
@@ -0,0 +1,17 @@
+from typing import Protocol
+
+
+class FileIdIndex(Protocol):
+    """
+    file_id видео, уже отправленных в Telegram, по ключу отрисовки (входные данные и настройки отрисовки).
+    По file_id видео отправляется повторно без отрисовки и загрузки
+    """
+
+    def get(self, key: str) -> str | None:
+        ...
+
+    def put(self, key: str, file_id: str) -> None:
+        ...
+
+    def discard(self, key: str) -> None:
+        ...
@@ -1,2 +1,18 @@
 class RecognitionError(Exception):
     pass
+
+
+class SerializationError(Exception):
+    pass
+
+
+class RenderingError(Exception):
+    pass
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+class InferenceError(Exception):
+    pass
@@ -0,0 +1,92 @@
+from contextlib import AbstractContextManager
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, Protocol
+
+from core.application.dto import AudioPath, ImagePath
+
+
+class Stage(str, Enum):
+    TEXT = "text"
+    SEPARATION = "separation"
+    RECOGNITION = "recognition"
+    LINKING = "linking"
+    PREVIEW = "preview"
+    RENDERING = "rendering"
+
+
+# Входные данные задачи, от которых напрямую зависит результат стадии
+STAGE_INPUTS: dict[Stage, tuple[str, ...]] = {
+    Stage.TEXT: ("song_title",),
+    Stage.SEPARATION: ("audio",),
+    Stage.RECOGNITION: (),
+    Stage.LINKING: (),
+    Stage.PREVIEW: ("cover_image",),
+    Stage.RENDERING: ("cover_image",),
+}
+
+# Стадии, результаты которых нужны для выполнения стадии
+STAGE_DEPENDENCIES: dict[Stage, tuple[Stage, ...]] = {
+    Stage.TEXT: (),
+    Stage.SEPARATION: (),
+    Stage.RECOGNITION: (Stage.SEPARATION,),
+    Stage.LINKING: (Stage.TEXT, Stage.RECOGNITION),
+    Stage.PREVIEW: (Stage.SEPARATION, Stage.LINKING),
+    Stage.RENDERING: (Stage.SEPARATION, Stage.LINKING),
+}
+
+
+class JobCheckpoint(Protocol):
+    def load(self, stage: Stage) -> Any | None:
+        """
+        Возвращает сохранённый результат стадии или None, если стадию нужно выполнить
+        """
+
+    def save(self, stage: Stage, result: Any) -> Any:
+        """
+        Сохраняет результат стадии и возвращает его сохранённую версию (например, с новыми путями к файлам)
+        """
+
+
+class InMemoryCheckpoint(JobCheckpoint):
+    def __init__(self):
+        self._results: dict[Stage, Any] = {}
+
+    def load(self, stage: Stage) -> Any | None:
+        return self._results.get(stage)
+
+    def save(self, stage: Stage, result: Any) -> Any:
+        self._results[stage] = result
+        return result
+
+
+class StageListener(Protocol):
+    def on_stage_started(self, stage: Stage) -> None:
+        ...
+
+    def on_stage_finished(self, stage: Stage, result: Any) -> None:
+        ...
+
+
+class StageProfiler(Protocol):
+    def profile(self, stage: Stage, destination: Path) -> AbstractContextManager:
+        """
+        Профилирует код внутри контекста и сохраняет результаты в папку destination
+        """
+
+
+@dataclass(slots=True)
+class Job:
+    audio: AudioPath
+    song_title: str
+    cover_image: ImagePath
+    checkpoint: JobCheckpoint = field(default_factory=InMemoryCheckpoint)
+    listener: StageListener | None = None
+    # Стадии, которые нужно профилировать, и папка для результатов профилирования
+    profile_stages: frozenset[Stage] = frozenset()
+    profile_dir: Path | None = None
+    # Длительность аудио в секундах, нужна для оценки времени выполнения
+    audio_duration: float | None = None
+    # Папка для файлов, которые создают стадии (например, видео). Если не задана - временная папка
+    work_dir: Path | None = None
@@ -0,0 +1,105 @@
+import os
+import resource
+import threading
+import time
+from dataclasses import dataclass
+from typing import Protocol
+
+from core.application.job import Stage
+
+
+@dataclass(slots=True, frozen=True)
+class StageMeasurement:
+    stage: Stage
+    wall_time: float
+    # Процессорное время процесса и дочерних процессов (ffmpeg).
+    # При параллельных задачах включает и время чужих потоков
+    cpu_time: float
+    # Пиковая резидентная память процесса за время стадии, без дочерних процессов.
+    # При параллельных задачах включает и память чужих стадий
+    peak_rss: int
+
+
+class MetricsRecorder(Protocol):
+    def record_stage(self, measurement: StageMeasurement) -> None:
+        ...
+
+    def record_render(self, name: str, audio_duration: float, frames: int) -> None:
+        ...
+
+    def set_queue_depth(self, queue: str, depth: int) -> None:
+        ...
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        ...
+
+
+class NullMetrics(MetricsRecorder):
+    def record_stage(self, measurement: StageMeasurement) -> None:
+        pass
+
+    def record_render(self, name: str, audio_duration: float, frames: int) -> None:
+        pass
+
+    def set_queue_depth(self, queue: str, depth: int) -> None:
+        pass
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        pass
+
+
+def _cpu_time() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def _rss() -> int | None:
+    # Второе поле statm - резидентная память в страницах
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """
+    Опрашивает резидентную память процесса в отдельном потоке и запоминает максимум.
+    ru_maxrss для этого не подходит: это пик за всё время жизни процесса, и после первой тяжёлой стадии
+    он одинаков для всех последующих
+    """
+    interval = 0.1
+
+    def __init__(self):
+        self.peak = _rss() or 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name="rss-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> int:
+        self._stopped.set()
+        self._thread.join()
+        return max(self.peak, _rss() or 0)
+
+    def _poll(self):
+        while not self._stopped.wait(self.interval):
+            rss = _rss()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+
+
+class StageTimer:
+    def __init__(self, stage: Stage):
+        self._stage = stage
+        self._wall_start = time.perf_counter()
+        self._cpu_start = _cpu_time()
+        self._rss = RssSampler()
+
+    def stop(self) -> StageMeasurement:
+        return StageMeasurement(
+            stage=self._stage,
+            wall_time=time.perf_counter() - self._wall_start,
+            cpu_time=_cpu_time() - self._cpu_start,
+            peak_rss=self._rss.stop(),
+        )
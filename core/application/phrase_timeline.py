@@ -0,0 +1,164 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from core.application.voice_recognition import Phrase, Word
+
+UNKNOWN_START = float('inf')
+UNKNOWN_END = -1.0
+
+EN_VOWELS = "aeiouу"
+RU_VOWELS = "еыаоэяию"
+VOWELS = EN_VOWELS + RU_VOWELS
+
+
+def vowel_weights(words: list[str], vowels: str = VOWELS) -> np.ndarray:
+    """
+    Вес слова для распределения времени - количество гласных, но не меньше 1
+    """
+    if not words:
+        return np.zeros(0, dtype=np.float64)
+    lengths = np.fromiter((len(word) for word in words), dtype=np.int64, count=len(words))
+    codes = np.frombuffer("".join(words).encode("utf-32-le"), dtype=np.uint32)
+    vowel_codes = np.frombuffer(vowels.encode("utf-32-le"), dtype=np.uint32)
+    is_vowel = np.isin(codes, vowel_codes).astype(np.int64)
+    # Префиксные суммы вместо reduceat, чтобы корректно обрабатывать пустые слова
+    cumulative = np.concatenate(([0], np.cumsum(is_vowel)))
+    ends = np.cumsum(lengths)
+    counts = cumulative[ends] - cumulative[ends - lengths]
+    return np.maximum(counts, 1).astype(np.float64)
+
+
+@dataclass(slots=True)
+class PhraseTimeline:
+    """
+    Колоночное представление list[Phrase]: тайминги слов и фраз лежат в массивах numpy,
+    строки - в отдельных списках. Слова фразы i - это срез word_offsets[i]:word_offsets[i + 1]
+    """
+    texts: list[str]
+    words: list[str]
+    phrase_starts: np.ndarray
+    phrase_ends: np.ndarray
+    word_offsets: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    weights: np.ndarray
+    phrase_index: np.ndarray
+
+    @classmethod
+    def from_phrases(cls, phrases: list[Phrase], vowels: str = VOWELS) -> "PhraseTimeline":
+        words = [word.word for phrase in phrases for word in phrase.words]
+        word_counts = np.fromiter((len(phrase.words) for phrase in phrases), dtype=np.int64, count=len(phrases))
+        return cls(
+            texts=[phrase.text for phrase in phrases],
+            words=words,
+            phrase_starts=np.fromiter((phrase.start for phrase in phrases), dtype=np.float64, count=len(phrases)),
+            phrase_ends=np.fromiter((phrase.end for phrase in phrases), dtype=np.float64, count=len(phrases)),
+            word_offsets=np.concatenate(([0], np.cumsum(word_counts))).astype(np.int64),
+            starts=np.fromiter((word.start for phrase in phrases for word in phrase.words),
+                               dtype=np.float64, count=len(words)),
+            ends=np.fromiter((word.end for phrase in phrases for word in phrase.words),
+                             dtype=np.float64, count=len(words)),
+            weights=vowel_weights(words, vowels),
+            phrase_index=np.repeat(np.arange(len(phrases), dtype=np.int64), word_counts),
+        )
+
+    @classmethod
+    def from_lines(cls, full_text: str, vowels: str = VOWELS) -> "PhraseTimeline":
+        """
+        Текст песни без таймингов: все слова помечены как неизвестные
+        """
+        lines = full_text.splitlines()
+        return cls.from_phrases(
+            [Phrase(line, UNKNOWN_START, UNKNOWN_END, [Word(word, UNKNOWN_START, UNKNOWN_END) for word in line.split()])
+             for line in lines],
+            vowels,
+        )
+
+    def to_phrases(self) -> list[Phrase]:
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+        offsets = self.word_offsets.tolist()
+        phrase_starts = self.phrase_starts.tolist()
+        phrase_ends = self.phrase_ends.tolist()
+        return [
+            Phrase(
+                text,
+                phrase_starts[i],
+                phrase_ends[i],
+                [Word(self.words[j], starts[j], ends[j]) for j in range(offsets[i], offsets[i + 1])],
+            )
+            for i, text in enumerate(self.texts)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.words)
+
+    def unknown_words(self) -> np.ndarray:
+        return self.ends == UNKNOWN_END
+
+    def unknown_phrases(self) -> np.ndarray:
+        return (self.phrase_starts == UNKNOWN_START) & (self.phrase_ends == UNKNOWN_END)
+
+    def phrase_words_mask(self, phrases_mask: np.ndarray) -> np.ndarray:
+        """
+        Переводит маску по фразам в маску по словам
+        """
+        return phrases_mask[self.phrase_index]
+
+    def phrase_weights(self) -> np.ndarray:
+        return np.bincount(self.phrase_index, weights=self.weights, minlength=len(self))
+
+    def interpolate_gaps(self, unknown: np.ndarray, head_start: float, tail_end: float) -> None:
+        """
+        Заполняет тайминги неизвестных слов. Каждая серия подряд идущих неизвестных слов
+        делит промежуток от конца предыдущего известного слова (или head_start)
+        до начала следующего (или tail_end) пропорционально весам слов
+        """
+        count = self.word_count
+        if count == 0 or not unknown.any():
+            return
+        index = np.arange(count)
+        known = ~unknown
+        previous_known = np.maximum.accumulate(np.where(known, index, -1))
+        next_known = np.minimum.accumulate(np.where(known, index, count)[::-1])[::-1]
+
+        gap_start = np.where(previous_known >= 0, self.ends[np.maximum(previous_known, 0)], head_start)
+        gap_end = np.where(next_known < count, self.starts[np.minimum(next_known, count - 1)], tail_end)
+
+        weights = np.where(unknown, self.weights, 0.0)
+        cumulative = np.cumsum(weights)
+        base = np.where(previous_known >= 0, cumulative[np.maximum(previous_known, 0)], 0.0)
+        run_total = cumulative[next_known - 1] - base
+        weight_until = cumulative - base
+        weight_before = weight_until - weights
+
+        delta = gap_end - gap_start
+        with np.errstate(invalid="ignore", divide="ignore"):
+            new_starts = gap_start + delta * weight_before / run_total
+            new_ends = gap_start + delta * weight_until / run_total
+        self.starts = np.where(unknown, new_starts, self.starts)
+        self.ends = np.where(unknown, new_ends, self.ends)
+
+    def sync_phrase_bounds(self) -> None:
+        """
+        Начало и конец фразы берутся по её первому и последнему слову
+        """
+        if not self.word_count:
+            return
+        first = np.clip(self.word_offsets[:-1], 0, self.word_count - 1)
+        last = np.clip(self.word_offsets[1:] - 1, 0, self.word_count - 1)
+        has_words = self.word_offsets[1:] > self.word_offsets[:-1]
+        self.phrase_starts = np.where(has_words, self.starts[first], self.phrase_starts)
+        self.phrase_ends = np.where(has_words, self.ends[last], self.phrase_ends)
+
+    def chain_phrases(self, start: float = 0.0) -> None:
+        """
+        Каждая фраза начинается там, где закончилась предыдущая - так фразы отрисовываются в видео
+        """
+        if len(self):
+            self.phrase_starts = np.concatenate(([start], self.phrase_ends[:-1]))
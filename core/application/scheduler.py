@@ -0,0 +1,313 @@
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Iterator
+
+from core.application.cost_model import CostModel, JobFeatures
+from core.application.dto import VideoPath
+from core.application.job import Job, Stage, STAGE_DEPENDENCIES
+from core.application.metrics import MetricsRecorder, NullMetrics
+from core.application.video_director import VideoDirector
+
+
+class Resource(str, Enum):
+    NETWORK = "network"
+    # У каждой модели свой пул: разделение одной песни не ждёт распознавания другой
+    SEPARATION_MODEL = "separation"
+    RECOGNITION_MODEL = "recognition"
+    CPU = "cpu"
+
+
+# Ресурс, который стадия нагружает сильнее всего. У каждого ресурса свой пул потоков
+STAGE_RESOURCES: dict[Stage, Resource] = {
+    Stage.TEXT: Resource.NETWORK,
+    Stage.SEPARATION: Resource.SEPARATION_MODEL,
+    Stage.RECOGNITION: Resource.RECOGNITION_MODEL,
+    Stage.LINKING: Resource.CPU,
+    Stage.PREVIEW: Resource.CPU,
+    Stage.RENDERING: Resource.CPU,
+}
+
+DEFAULT_WORKERS: dict[Resource, int] = {
+    Resource.NETWORK: 4,
+    Resource.SEPARATION_MODEL: 1,
+    Resource.RECOGNITION_MODEL: 1,
+    Resource.CPU: 2,
+}
+
+MB = 1024 * 1024
+# Оценка памяти, которую стадия занимает сверх уже загруженных моделей, байты
+STAGE_MEMORY: dict[Stage, int] = {
+    Stage.TEXT: 50 * MB,
+    Stage.SEPARATION: 2048 * MB,
+    Stage.RECOGNITION: 3072 * MB,
+    Stage.LINKING: 200 * MB,
+    Stage.PREVIEW: 512 * MB,
+    Stage.RENDERING: 1536 * MB,
+}
+
+
+class MemoryBudget:
+    """
+    Ограничивает суммарную оценку памяти одновременно выполняемых стадий.
+    Стадия дороже всего бюджета выполняется, только когда остальные стадии закончились
+    """
+
+    def __init__(self, total: int | None = None):
+        self.total = total
+        self.used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, cost: int) -> Iterator[None]:
+        if self.total is not None:
+            cost = min(cost, self.total)
+        with self._condition:
+            self._condition.wait_for(lambda: self.total is None or self.used + cost <= self.total)
+            self.used += cost
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= cost
+                self._condition.notify_all()
+
+
+# На сколько секунд ожидаемого времени задача становится "короче" за каждую секунду в очереди.
+# Благодаря этому длинные задачи не ждут бесконечно, если короткие приходят постоянно
+AGING_RATE = 1.0
+
+
+@dataclass(eq=False)
+class JobState:
+    job: Job
+    stages: tuple[Stage, ...]
+    # Ожидаемое время стадий, для уже сохранённых в чекпоинте - 0
+    costs: dict[Stage, float] = field(default_factory=dict)
+    submitted_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+    done: set[Stage] = field(default_factory=set)
+    scheduled: set[Stage] = field(default_factory=set)
+    started: dict[Stage, float] = field(default_factory=dict)
+    result: VideoPath | None = None
+
+    @property
+    def expected_seconds(self) -> float:
+        return sum(self.costs.values())
+
+    def priority(self, now: float) -> float:
+        """
+        Чем меньше, тем раньше выполняются стадии задачи
+        """
+        return self.expected_seconds - AGING_RATE * (now - self.submitted_at)
+
+    def remaining(self, stage: Stage, now: float) -> float:
+        if stage in self.done:
+            return 0.0
+        return max(self.costs.get(stage, 0.0) - (now - self.started.get(stage, now)), 0.0)
+
+
+@dataclass(eq=False)
+class StageTask:
+    state: JobState
+    stage: Stage
+    queued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def job(self) -> Job:
+        return self.state.job
+
+
+class TaskQueue:
+    """
+    Очередь стадий одного ресурса. Порядок выдачи задаёт select, по умолчанию - порядок постановки
+    """
+
+    def __init__(self):
+        self._tasks: list[StageTask] = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def put(self, task: StageTask):
+        with self._condition:
+            self._tasks.append(task)
+            self._condition.notify()
+
+    def get(self) -> StageTask | None:
+        """
+        Ждёт следующую задачу. После close возвращает None
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._tasks or self._closed)
+            if self._closed:
+                return None
+            return self._tasks.pop(self.select(self._tasks))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def select(self, tasks: list[StageTask]) -> int:
+        return 0
+
+
+class ShortestJobFirstQueue(TaskQueue):
+    """
+    Первой выдаётся стадия задачи с наименьшим ожидаемым временем с учётом времени ожидания
+    """
+
+    def select(self, tasks: list[StageTask]) -> int:
+        now = time.monotonic()
+        return min(range(len(tasks)), key=lambda i: tasks[i].state.priority(now))
+
+
+class StageScheduler:
+    """
+    Выполняет стадии задач как отдельные задания: стадия попадает в очередь своего ресурса,
+    как только готовы стадии, от которых она зависит. Поэтому одна задача может отрисовываться,
+    пока у другой разделяется звук, а у третьей распознаётся текст.
+
+    С моделью стоимости очереди отдают стадии сначала коротким задачам, без неё - в порядке поступления
+    """
+
+    def __init__(
+            self,
+            director: VideoDirector,
+            workers: dict[Resource, int] | None = None,
+            memory_budget: int | None = None,
+            stage_memory: dict[Stage, int] | None = None,
+            metrics: MetricsRecorder | None = None,
+            cost_model: CostModel | None = None,
+    ):
+        self._director = director
+        self._workers = workers or DEFAULT_WORKERS
+        self._cost_model = cost_model
+        self._active: dict[int, JobState] = {}
+        self._memory = MemoryBudget(memory_budget)
+        self._stage_memory = stage_memory or STAGE_MEMORY
+        self._metrics = metrics or NullMetrics()
+        # Реентерабельная: future задачи завершается под блокировкой, а его колбэк тоже её берёт
+        self._lock = threading.RLock()
+        self._queues = {resource: self.create_queue(resource) for resource in Resource}
+        self._threads = [
+            threading.Thread(target=self._work, args=(resource,), name=f"{resource.value}-{i}", daemon=True)
+            for resource, count in self._workers.items()
+            for i in range(count)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def create_queue(self, resource: Resource) -> TaskQueue:
+        return TaskQueue() if self._cost_model is None else ShortestJobFirstQueue()
+
+    def submit(self, job: Job) -> Future:
+        """
+        Ставит задачу в работу. Future завершается путём к видео после последней стадии
+        """
+        state = self._new_state(job)
+        state.future.add_done_callback(lambda _: self._forget(state))
+        with self._lock:
+            self._active[id(job)] = state
+            ready = self._take_ready(state)
+        for task in ready:
+            self._enqueue(task)
+        return state.future
+
+    def estimate(self, job: Job) -> float | None:
+        """
+        Ожидаемое время до готовности видео, секунды: время самой длинной цепочки оставшихся стадий
+        и время на стадии задач, которые выполнятся раньше. Без модели стоимости - None
+        """
+        if self._cost_model is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            state = self._active.get(id(job)) or self._new_state(job)
+            others = [other for other in self._active.values() if other is not state]
+        finish: dict[Stage, float] = {}
+        for stage in state.stages:
+            dependencies = [finish[dependency] for dependency in STAGE_DEPENDENCIES[stage] if dependency in finish]
+            finish[stage] = state.remaining(stage, now) + max(dependencies, default=0.0)
+        backlog = dict.fromkeys(Resource, 0.0)
+        priority = state.priority(now)
+        for other in others:
+            if other.priority(now) <= priority:
+                for stage in other.stages:
+                    backlog[STAGE_RESOURCES[stage]] += other.remaining(stage, now)
+        waiting = max(backlog[resource] / self._workers.get(resource, 1) for resource in Resource)
+        return max(finish.values(), default=0.0) + waiting
+
+    def shutdown(self):
+        for queue in self._queues.values():
+            queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def _new_state(self, job: Job) -> JobState:
+        state = JobState(job, self._director.stages)
+        if self._cost_model is not None:
+            features = JobFeatures.of(job)
+            state.costs = {
+                stage: 0.0 if job.checkpoint.load(stage) is not None else self._cost_model.predict(stage, features)
+                for stage in state.stages
+            }
+        return state
+
+    def _forget(self, state: JobState):
+        with self._lock:
+            self._active.pop(id(state.job), None)
+
+    def _take_ready(self, state: JobState) -> list[StageTask]:
+        """
+        Стадии, все зависимости которых выполнены. Вызывается под self._lock
+        """
+        ready = [
+            stage for stage in state.stages
+            if stage not in state.scheduled
+            and all(dependency in state.done for dependency in STAGE_DEPENDENCIES[stage] if dependency in state.stages)
+        ]
+        state.scheduled.update(ready)
+        return [StageTask(state, stage) for stage in ready]
+
+    def _enqueue(self, task: StageTask):
+        resource = STAGE_RESOURCES[task.stage]
+        self._queues[resource].put(task)
+        self._metrics.set_queue_depth(resource.value, len(self._queues[resource]))
+
+    def _work(self, resource: Resource):
+        queue = self._queues[resource]
+        while (task := queue.get()) is not None:
+            self._metrics.set_queue_depth(resource.value, len(queue))
+            if task.state.future.done():
+                # Другая стадия задачи уже завершилась ошибкой
+                continue
+            task.state.started[task.stage] = time.monotonic()
+            try:
+                with self._memory.reserve(self._stage_memory.get(task.stage, 0)):
+                    result = self._director.run_stage(task.job, task.stage)
+            except Exception as e:
+                with self._lock:
+                    if not task.state.future.done():
+                        task.state.future.set_exception(e)
+                continue
+            self._complete(task, result)
+
+    def _complete(self, task: StageTask, result):
+        state = task.state
+        with self._lock:
+            state.done.add(task.stage)
+            if task.stage == state.stages[-1]:
+                state.result = result
+            finished = len(state.done) == len(state.stages)
+            ready = [] if finished else self._take_ready(state)
+        if finished:
+            state.future.set_result(state.result)
+        for next_task in ready:
+            self._enqueue(next_task)
@@ -0,0 +1,50 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Generic, TypeVar
+
+S = TypeVar("S")
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class Flight(Generic[S]):
+    # Список пополняется, пока задача выполняется: новые подписчики присоединяются к ней
+    subscribers: list[S]
+    result: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class SingleFlight(Generic[S, T]):
+    """
+    Не даёт запустить одну и ту же работу дважды: пока работа по ключу выполняется,
+    повторные вызовы с тем же ключом становятся подписчиками и ждут её результата
+    """
+
+    def __init__(self):
+        self._flights: dict[str, Flight[S]] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    async def run(self, key: str, subscriber: S, work: Callable[[Flight[S]], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.subscribers.append(subscriber)
+            return await asyncio.shield(flight.result)
+
+        flight = Flight([subscriber])
+        self._flights[key] = flight
+        try:
+            result = await work(flight)
+        except BaseException as error:
+            flight.result.set_exception(error)
+            # Исключение уже получит ведущий вызов, подписчиков может и не быть
+            flight.result.exception()
+            raise
+        else:
+            flight.result.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
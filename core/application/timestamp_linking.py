@@ -1,3 +1,4 @@
+from difflib import SequenceMatcher
 from typing import Protocol
 
 from core.application.voice_recognition import Phrase
@@ -8,3 +9,25 @@ class TimestampLinker(Protocol):
         """
         Принимает полный верный текст песни и подвязывает его под распознанные слова с временными метками
         """
+
+
+class IncrementalLinker(Protocol):
+    def relink(self, full_text: str, previous_text: str, previous_phrases: list[Phrase],
+               phrases: list[Phrase]) -> list[Phrase]:
+        """
+        Разметка исправленного текста песни: previous_phrases - разметка previous_text,
+        заново подвязываются только изменённые строки
+        """
+
+
+def diff_lines(previous_text: str, text: str) -> list[int | None]:
+    """
+    Для каждой строки text - номер такой же строки previous_text или None, если строка новая или изменена
+    """
+    previous_lines = previous_text.split("\n")
+    lines = text.split("\n")
+    matches: list[int | None] = [None] * len(lines)
+    for block in SequenceMatcher(None, previous_lines, lines, autojunk=False).get_matching_blocks():
+        for offset in range(block.size):
+            matches[block.b + offset] = block.a + offset
+    return matches
@@ -1,10 +1,22 @@
-from core.application.separation import AudioSeparator
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+from core.application.cost_model import CostModel, JobFeatures
+from core.application.job import Job, Stage, STAGE_DEPENDENCIES, StageProfiler
+from core.application.metrics import MetricsRecorder, NullMetrics, StageTimer
+from core.application.separation import AudioSeparator, SeparationResult
 from core.application.text_generation import TextGenerator
-from core.application.timestamp_linking import TimestampLinker
-from core.application.video_maker import VideoMaker
+from core.application.timestamp_linking import IncrementalLinker, TimestampLinker
+from core.application.video_maker import IncrementalVideoMaker, VideoMaker
 from core.application.dto import AudioPath, ImagePath, VideoPath
+from core.application.exceptions import RenderingError
 from core.application.voice_recognition import VoiceRecognizer, Phrase
 
+# Стадии, результаты которых нужны для исправления текста
+LYRICS_EDIT_STAGES = (Stage.TEXT, Stage.SEPARATION, Stage.RECOGNITION, Stage.LINKING)
+
 
 class VideoDirector:
     def __init__(
@@ -14,19 +26,177 @@ class VideoDirector:
             voice_recognizer: VoiceRecognizer,
             timestamp_linker: TimestampLinker,
             video_maker: VideoMaker,
+            preview_maker: VideoMaker | None = None,
+            metrics: MetricsRecorder | None = None,
+            profiler: StageProfiler | None = None,
+            cost_model: CostModel | None = None,
+            lyrics_linker: IncrementalLinker | None = None,
+            video_editor: IncrementalVideoMaker | None = None,
     ):
         self._audio_separator = audio_separator
         self._text_generator = text_generator
         self._voice_recognizer = voice_recognizer
         self._timestamp_linker = timestamp_linker
         self._video_maker = video_maker
+        self._preview_maker = preview_maker
+        self._metrics = metrics or NullMetrics()
+        self._profiler = profiler
+        self.cost_model = cost_model
+        self._lyrics_linker = lyrics_linker
+        self._video_editor = video_editor
+        self._stage_handlers: dict[Stage, Callable[[Job, dict[Stage, Any]], Any]] = {
+            Stage.TEXT: self._get_song_text,
+            Stage.SEPARATION: self._separate,
+            Stage.RECOGNITION: self._recognize,
+            Stage.LINKING: self._link,
+            Stage.PREVIEW: self._render_preview,
+            Stage.RENDERING: self._render,
+        }
+        # Превью отрисовывается сразу после разметки, до полного видео
+        self.stages = tuple(
+            stage for stage in self._stage_handlers
+            if stage != Stage.PREVIEW or self._preview_maker is not None
+        )
 
     def make_video(self, audio: AudioPath, song_title: str, cover_image: ImagePath) -> VideoPath:
-        separation_result = self._audio_separator.separate_into_vocals_and_music(audio_file=audio)
-        recognized_phrases = self._voice_recognizer.get_text_from_vocals(vocals=separation_result.vocals)
-        song_text = self._text_generator.get_text_for_a_song(song_title=song_title)
-        timestamped_phrases = self._timestamp_linker.link_timestamps_to_song_text(full_text=song_text,
-                                                                                  phrases=recognized_phrases)
-        return self._video_maker.compile_video(song_title=song_title, cover_image=cover_image,
-                                               back_track=separation_result.back_track,
-                                               timestamped_phrases=timestamped_phrases)
+        return self.run_job(Job(audio=audio, song_title=song_title, cover_image=cover_image))
+
+    def run_job(self, job: Job) -> VideoPath:
+        """
+        Выполняет все стадии задачи. Стадии, сохранённые в job.checkpoint, не пересчитываются
+        """
+        result = None
+        for stage in self.stages:
+            result = self.run_stage(job, stage)
+        return result
+
+    def run_stage(self, job: Job, stage: Stage) -> Any:
+        """
+        Выполняет стадию, если её нет в чекпоинте. Попадание в чекпоинт учитывается в метриках
+        только здесь, а не при загрузке результатов зависимостей
+        """
+        result = job.checkpoint.load(stage)
+        self._metrics.record_cache(f"checkpoint:{stage.value}", hit=result is not None)
+        if result is not None:
+            return result
+        return self._execute_stage(job, stage)
+
+    def _load_or_execute(self, job: Job, stage: Stage) -> Any:
+        result = job.checkpoint.load(stage)
+        return result if result is not None else self._execute_stage(job, stage)
+
+    def _execute_stage(self, job: Job, stage: Stage) -> Any:
+        dependencies = self._dependency_results(job, stage)
+        if job.listener is not None:
+            job.listener.on_stage_started(stage)
+        timer = StageTimer(stage)
+        try:
+            if stage in job.profile_stages and self._profiler is not None and job.profile_dir is not None:
+                with self._profiler.profile(stage, job.profile_dir):
+                    result = self._stage_handlers[stage](job, dependencies)
+            else:
+                result = self._stage_handlers[stage](job, dependencies)
+        finally:
+            # Таймер останавливается и при ошибке, иначе поток опроса памяти остался бы работать
+            measurement = timer.stop()
+        self._metrics.record_stage(measurement)
+        result = job.checkpoint.save(stage, result)
+        if self.cost_model is not None:
+            self.cost_model.record(stage, JobFeatures.of(job), measurement.wall_time)
+        if job.listener is not None:
+            job.listener.on_stage_finished(stage, result)
+        return result
+
+    @staticmethod
+    def can_edit_lyrics(job: Job) -> bool:
+        """
+        Исправить текст можно, только если в чекпоинте есть все стадии, кроме отрисовки: иначе пришлось бы
+        разделять и распознавать аудио в обход планировщика и его ограничения памяти
+        """
+        return all(job.checkpoint.load(stage) is not None for stage in LYRICS_EDIT_STAGES)
+
+    def edit_lyrics(self, job: Job, corrected_text: str) -> VideoPath:
+        """
+        Исправление текста песни в готовой задаче. Если заданы lyrics_linker и video_editor, заново размечаются
+        только изменённые строки и заново отрисовываются только затронутые ими участки видео
+        (если прежнее видео удалено из чекпоинта - всё видео).
+        Текст, разметка и видео в чекпоинте заменяются исправленными.
+        Стадии LYRICS_EDIT_STAGES берутся только из чекпоинта (см. can_edit_lyrics)
+        """
+        if not self.can_edit_lyrics(job):
+            raise RenderingError("Для исправления текста в чекпоинте не хватает выполненных стадий")
+        previous_text = job.checkpoint.load(Stage.TEXT)
+        previous_phrases = job.checkpoint.load(Stage.LINKING)
+        previous_video = job.checkpoint.load(Stage.RENDERING)
+        separation_result: SeparationResult = job.checkpoint.load(Stage.SEPARATION)
+        recognized_phrases: list[Phrase] = job.checkpoint.load(Stage.RECOGNITION)
+
+        if job.listener is not None:
+            job.listener.on_stage_started(Stage.LINKING)
+        if self._lyrics_linker is not None:
+            phrases = self._lyrics_linker.relink(corrected_text, previous_text, previous_phrases, recognized_phrases)
+        else:
+            phrases = self._timestamp_linker.link_timestamps_to_song_text(corrected_text, recognized_phrases)
+        if job.listener is not None:
+            job.listener.on_stage_finished(Stage.LINKING, phrases)
+            job.listener.on_stage_started(Stage.RENDERING)
+        if self._video_editor is not None and previous_video is not None:
+            video = self._video_editor.rerender_video(
+                song_title=job.song_title, cover_image=job.cover_image, back_track=separation_result.back_track,
+                previous_phrases=previous_phrases, timestamped_phrases=phrases, previous_video=previous_video,
+                destination=self._video_destination(job, Stage.RENDERING),
+            )
+        else:
+            video = self._video_maker.compile_video(song_title=job.song_title, cover_image=job.cover_image,
+                                                    back_track=separation_result.back_track,
+                                                    timestamped_phrases=phrases,
+                                                    destination=self._video_destination(job, Stage.RENDERING))
+        # Текст и разметка сохраняются вместе с видео: если отрисовка не удалась, в чекпоинте остаётся
+        # прежний согласованный набор, и исправление можно повторить
+        job.checkpoint.save(Stage.TEXT, corrected_text)
+        job.checkpoint.save(Stage.LINKING, phrases)
+        video = job.checkpoint.save(Stage.RENDERING, video)
+        if job.listener is not None:
+            job.listener.on_stage_finished(Stage.RENDERING, video)
+        return video
+
+    def _dependency_results(self, job: Job, stage: Stage) -> dict[Stage, Any]:
+        return {dependency: self._load_or_execute(job, dependency) for dependency in STAGE_DEPENDENCIES[stage]}
+
+    def _get_song_text(self, job: Job, dependencies: dict[Stage, Any]) -> str:
+        return self._text_generator.get_text_for_a_song(song_title=job.song_title)
+
+    def _separate(self, job: Job, dependencies: dict[Stage, Any]) -> SeparationResult:
+        return self._audio_separator.separate_into_vocals_and_music(audio_file=job.audio)
+
+    def _recognize(self, job: Job, dependencies: dict[Stage, Any]) -> list[Phrase]:
+        separation_result: SeparationResult = dependencies[Stage.SEPARATION]
+        return self._voice_recognizer.get_text_from_vocals(vocals=separation_result.vocals)
+
+    def _link(self, job: Job, dependencies: dict[Stage, Any]) -> list[Phrase]:
+        song_text: str = dependencies[Stage.TEXT]
+        recognized_phrases: list[Phrase] = dependencies[Stage.RECOGNITION]
+        return self._timestamp_linker.link_timestamps_to_song_text(full_text=song_text, phrases=recognized_phrases)
+
+    def _render_preview(self, job: Job, dependencies: dict[Stage, Any]) -> VideoPath:
+        return self._compile(job, dependencies, self._preview_maker, Stage.PREVIEW)
+
+    def _render(self, job: Job, dependencies: dict[Stage, Any]) -> VideoPath:
+        return self._compile(job, dependencies, self._video_maker, Stage.RENDERING)
+
+    def _compile(self, job: Job, dependencies: dict[Stage, Any], video_maker: VideoMaker, stage: Stage) -> VideoPath:
+        separation_result: SeparationResult = dependencies[Stage.SEPARATION]
+        timestamped_phrases: list[Phrase] = dependencies[Stage.LINKING]
+        return video_maker.compile_video(song_title=job.song_title, cover_image=job.cover_image,
+                                         back_track=separation_result.back_track,
+                                         timestamped_phrases=timestamped_phrases,
+                                         destination=self._video_destination(job, stage))
+
+    @staticmethod
+    def _video_destination(job: Job, stage: Stage) -> Path:
+        """
+        Новый файл в папке задачи: задачи с одинаковым названием песни не перезаписывают видео друг друга,
+        а прежнее видео задачи остаётся целым, пока новое не отрисовано
+        """
+        work_dir = job.work_dir or Path(tempfile.mkdtemp(prefix="karaoke-"))
+        return work_dir / f"{stage.value}.{uuid.uuid4().hex[:8]}.mp4"
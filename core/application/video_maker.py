@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import Protocol
 
 from core.application.dto import AudioPath, ImagePath, VideoPath
@@ -10,6 +11,25 @@ class VideoMaker(Protocol):
             song_title: str,
             cover_image: ImagePath,
             back_track: AudioPath,
-            timestamped_phrases: list[Phrase]
+            timestamped_phrases: list[Phrase],
+            destination: Path | None = None,
     ) -> VideoPath:
-        ...
+        """
+        Отрисовывает видео в файл destination. Если он не задан, файл выбирает реализация
+        """
+
+
+class IncrementalVideoMaker(VideoMaker, Protocol):
+    def rerender_video(
+            self,
+            song_title: str,
+            cover_image: ImagePath,
+            back_track: AudioPath,
+            previous_phrases: list[Phrase],
+            timestamped_phrases: list[Phrase],
+            previous_video: VideoPath,
+            destination: Path | None = None,
+    ) -> VideoPath:
+        """
+        Видео с новой разметкой, в котором заново отрисованы только участки, где разметка изменилась
+        """
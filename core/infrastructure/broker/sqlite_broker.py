@@ -0,0 +1,277 @@
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Collection, Iterator
+
+from core.application.broker import Broker, JobInputs, LeasedTask, TaskState
+from core.application.exceptions import LeaseLostError
+from core.application.job import Stage, STAGE_DEPENDENCIES
+
+DATABASE_NAME = "broker.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    song_title TEXT NOT NULL,
+    audio TEXT NOT NULL,
+    cover_image TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id),
+    stage TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    error TEXT,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (state, available_at);
+"""
+
+
+class SqliteBroker(Broker):
+    """
+    Очередь стадий в базе SQLite, входные файлы и результаты стадий - в папках рядом с ней.
+    Исполнители на других машинах работают с той же папкой, например, через сетевой диск.
+
+    Просроченная аренда возвращает стадию в очередь при следующей выдаче стадий.
+    Повторные попытки откладываются на RETRY_DELAY секунд за каждую неудачную попытку
+    """
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 10.0
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def submit(self, job_id: str, inputs: JobInputs, stages: tuple[Stage, ...],
+               completed: dict[Stage, Path] | None = None) -> None:
+        completed = completed or {}
+        if self._is_active(job_id):
+            return
+        job_dir = self._inputs_dir(job_id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        audio = job_dir / f"audio{inputs.audio.suffix}"
+        cover_image = job_dir / f"cover{inputs.cover_image.suffix}"
+        # Файлы копируются до транзакции: пока она открыта, база заблокирована для всех исполнителей,
+        # а копирование аудио по сетевому диску может занять десятки секунд. В транзакции файлы только
+        # переименовываются
+        staging = self.root / "staging" / uuid.uuid4().hex
+        staging.mkdir(parents=True)
+        try:
+            shutil.copy2(inputs.audio, staging / audio.name)
+            shutil.copy2(inputs.cover_image, staging / cover_image.name)
+            for stage, artifacts in completed.items():
+                shutil.copytree(artifacts, staging / stage.value)
+            with self._transaction() as connection:
+                if self._is_active(job_id, connection):
+                    return
+                (staging / audio.name).replace(audio)
+                (staging / cover_image.name).replace(cover_image)
+                for stage in completed:
+                    destination = self._artifacts_dir(job_id, stage)
+                    shutil.rmtree(destination, ignore_errors=True)
+                    (staging / stage.value).rename(destination)
+                self._insert_job(connection, job_id, inputs, stages, completed, audio, cover_image)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def lease(self, worker_id: str, stages: Collection[Stage], lease_seconds: float) -> LeasedTask | None:
+        if not stages:
+            return None
+        now = time.time()
+        with self._transaction() as connection:
+            self._expire_leases(connection, now)
+            placeholders = ", ".join("?" * len(stages))
+            row = connection.execute(
+                f"""
+                SELECT tasks.job_id, tasks.stage, tasks.attempts, jobs.audio, jobs.song_title, jobs.cover_image
+                FROM tasks JOIN jobs USING (job_id)
+                WHERE tasks.state = ? AND tasks.available_at <= ? AND tasks.stage IN ({placeholders})
+                ORDER BY jobs.created_at, tasks.position
+                LIMIT 1
+                """,
+                (TaskState.READY.value, now, *(stage.value for stage in stages)),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, stage, attempts, audio, song_title, cover_image = row
+            connection.execute(
+                "UPDATE tasks SET state = ?, attempts = ?, worker_id = ?, lease_expires = ? "
+                "WHERE job_id = ? AND stage = ?",
+                (TaskState.LEASED.value, attempts + 1, worker_id, now + lease_seconds, job_id, stage),
+            )
+        return LeasedTask(job_id, Stage(stage), attempts + 1, JobInputs(Path(audio), song_title, Path(cover_image)))
+
+    def heartbeat(self, task: LeasedTask, worker_id: str, lease_seconds: float) -> bool:
+        with self._transaction() as connection:
+            updated = connection.execute(
+                "UPDATE tasks SET lease_expires = ? "
+                "WHERE job_id = ? AND stage = ? AND state = ? AND worker_id = ? AND attempts = ?",
+                (time.time() + lease_seconds, task.job_id, task.stage.value, TaskState.LEASED.value, worker_id,
+                 task.attempt),
+            ).rowcount
+        return updated == 1
+
+    def complete(self, task: LeasedTask, worker_id: str, artifacts: Path) -> None:
+        # Результаты копируются до отметки о выполнении, чтобы зависимые стадии не увидели их недописанными
+        destination = self._artifacts_dir(task.job_id, task.stage)
+        temporary = destination.with_name(f"{destination.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copytree(artifacts, temporary)
+        with self._transaction() as connection:
+            if not self._owns_lease(connection, task, worker_id):
+                shutil.rmtree(temporary)
+                raise LeaseLostError(f"Аренда стадии {task.stage.value} задачи {task.job_id} потеряна")
+            shutil.rmtree(destination, ignore_errors=True)
+            temporary.rename(destination)
+            connection.execute(
+                "UPDATE tasks SET state = ?, lease_expires = NULL, error = NULL WHERE job_id = ? AND stage = ?",
+                (TaskState.DONE.value, task.job_id, task.stage.value),
+            )
+            self._release_dependents(connection, task.job_id)
+
+    def fail(self, task: LeasedTask, worker_id: str, error: str) -> None:
+        with self._transaction() as connection:
+            if not self._owns_lease(connection, task, worker_id):
+                return
+            self._retry_or_fail(connection, task.job_id, task.stage.value, task.attempt, error, time.time())
+
+    def status(self, job_id: str) -> dict[Stage, TaskState]:
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT stage, state FROM tasks WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return {Stage(stage): TaskState(state) for stage, state in rows}
+
+    def error(self, job_id: str) -> str | None:
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT error FROM tasks WHERE job_id = ? AND state = ? AND error IS NOT NULL",
+                (job_id, TaskState.FAILED.value),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def fetch_artifacts(self, job_id: str, stage: Stage, destination: Path) -> None:
+        shutil.copytree(self._artifacts_dir(job_id, stage), destination, dirs_exist_ok=True)
+
+    def _inputs_dir(self, job_id: str) -> Path:
+        return self.root / "inputs" / job_id
+
+    def _artifacts_dir(self, job_id: str, stage: Stage) -> Path:
+        path = self.root / "artifacts" / job_id / stage.value
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _insert_job(self, connection: sqlite3.Connection, job_id: str, inputs: JobInputs, stages: tuple[Stage, ...],
+                    completed: dict[Stage, Path], audio: Path, cover_image: Path):
+        now = time.time()
+        connection.execute("DELETE FROM tasks WHERE job_id = ?", (job_id,))
+        connection.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+            (job_id, inputs.song_title, str(audio), str(cover_image), now),
+        )
+        connection.executemany(
+            "INSERT INTO tasks (job_id, stage, position, state, available_at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (job_id, stage.value, position, self._initial_state(stage, stages, completed).value, now)
+                for position, stage in enumerate(stages)
+            ],
+        )
+        self._release_dependents(connection, job_id)
+
+    def _is_active(self, job_id: str, connection: sqlite3.Connection | None = None) -> bool:
+        """
+        Задача уже поставлена и не провалилась - повторная постановка ничего не делает
+        """
+        if connection is None:
+            with closing(self._connect()) as connection:
+                return self._is_active(job_id, connection)
+        states = {row[0] for row in connection.execute("SELECT state FROM tasks WHERE job_id = ?", (job_id,))}
+        return bool(states) and TaskState.FAILED.value not in states
+
+    @staticmethod
+    def _initial_state(stage: Stage, stages: tuple[Stage, ...], completed: dict[Stage, Path]) -> TaskState:
+        if stage in completed:
+            return TaskState.DONE
+        if any(dependency in stages for dependency in STAGE_DEPENDENCIES[stage]):
+            return TaskState.WAITING
+        return TaskState.READY
+
+    @staticmethod
+    def _owns_lease(connection: sqlite3.Connection, task: LeasedTask, worker_id: str) -> bool:
+        row = connection.execute(
+            "SELECT 1 FROM tasks WHERE job_id = ? AND stage = ? AND state = ? AND worker_id = ? AND attempts = ?",
+            (task.job_id, task.stage.value, TaskState.LEASED.value, worker_id, task.attempt),
+        ).fetchone()
+        return row is not None
+
+    def _expire_leases(self, connection: sqlite3.Connection, now: float):
+        expired = connection.execute(
+            "SELECT job_id, stage, attempts FROM tasks WHERE state = ? AND lease_expires < ?",
+            (TaskState.LEASED.value, now),
+        ).fetchall()
+        for job_id, stage, attempts in expired:
+            self._retry_or_fail(connection, job_id, stage, attempts, "Истекла аренда", now)
+
+    def _retry_or_fail(self, connection: sqlite3.Connection, job_id: str, stage: str, attempts: int, error: str,
+                       now: float):
+        if attempts < self.MAX_ATTEMPTS:
+            connection.execute(
+                "UPDATE tasks SET state = ?, worker_id = NULL, lease_expires = NULL, available_at = ?, error = ? "
+                "WHERE job_id = ? AND stage = ?",
+                (TaskState.READY.value, now + self.RETRY_DELAY * attempts, error, job_id, stage),
+            )
+            return
+        connection.execute(
+            "UPDATE tasks SET state = ?, worker_id = NULL, lease_expires = NULL, error = ? "
+            "WHERE job_id = ? AND stage = ?",
+            (TaskState.FAILED.value, error, job_id, stage),
+        )
+        # Остальные стадии задачи выполнять уже незачем
+        connection.execute(
+            "UPDATE tasks SET state = ? WHERE job_id = ? AND state IN (?, ?)",
+            (TaskState.FAILED.value, job_id, TaskState.WAITING.value, TaskState.READY.value),
+        )
+
+    @staticmethod
+    def _release_dependents(connection: sqlite3.Connection, job_id: str):
+        states = {
+            Stage(stage): TaskState(state)
+            for stage, state in connection.execute("SELECT stage, state FROM tasks WHERE job_id = ?", (job_id,))
+        }
+        ready = [
+            stage.value for stage, state in states.items()
+            if state == TaskState.WAITING
+            and all(states.get(dependency, TaskState.DONE) == TaskState.DONE for dependency in STAGE_DEPENDENCIES[stage])
+        ]
+        connection.executemany(
+            "UPDATE tasks SET state = ?, available_at = ? WHERE job_id = ? AND stage = ?",
+            [(TaskState.READY.value, time.time(), job_id, stage) for stage in ready],
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Соединение на одну транзакцию: брокер используется из разных потоков и процессов.
+        BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому две машины не получат одну стадию
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.root / DATABASE_NAME, timeout=30, isolation_level=None)
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any
+
+from core.application.dto import AudioPath, ImagePath, VideoPath
+from core.application.exceptions import SerializationError
+from core.application.job import JobCheckpoint, Stage, STAGE_DEPENDENCIES, STAGE_INPUTS
+from core.application.separation import SeparationResult
+from core.infrastructure.phrase_storage.binary_format import BINARY_SUFFIX, from_binary, save_to_binary
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Описание стадии в папке экспорта
+STAGE_ENTRY_NAME = "stage.json"
+
+
+def file_fingerprint(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FileJobCheckpoint(JobCheckpoint):
+    """
+    Хранит результаты стадий в папке задачи и описывает их в manifest.json.
+
+    Для каждой стадии запоминается ключ - хеш входных данных стадии и ключей стадий, от которых она зависит.
+    Стадия считается выполненной, пока её ключ совпадает с текущим, поэтому, например, новая обложка
+    инвалидирует только отрисовку, а новое аудио - всё, кроме текста песни
+    """
+
+    def __init__(self, job_dir: Path, audio: AudioPath, song_title: str, cover_image: ImagePath):
+        self.job_dir = job_dir
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._input_fingerprints = {
+            "audio": file_fingerprint(audio),
+            "song_title": text_fingerprint(song_title),
+            "cover_image": file_fingerprint(cover_image),
+        }
+        self._manifest = self._read_manifest()
+        if self._manifest.get("fingerprints") != self._input_fingerprints:
+            # Новые входные данные - новая задача, которую ещё не запускали
+            self._manifest["finished"] = False
+            self._manifest["attempts"] = 0
+            self._manifest["error"] = None
+        self._manifest["inputs"] = {"audio": str(audio), "song_title": song_title, "cover_image": str(cover_image)}
+        self._manifest["fingerprints"] = self._input_fingerprints
+        self._write_manifest()
+
+    @classmethod
+    def open(cls, job_dir: Path) -> "FileJobCheckpoint | None":
+        """
+        Открывает существующую задачу по её манифесту, если её входные файлы ещё на месте
+        """
+        try:
+            with open(job_dir / MANIFEST_NAME, encoding="utf8") as f:
+                inputs = json.load(f)["inputs"]
+            return cls(job_dir, Path(inputs["audio"]), inputs["song_title"], Path(inputs["cover_image"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @property
+    def audio(self) -> AudioPath:
+        return Path(self._manifest["inputs"]["audio"])
+
+    @property
+    def song_title(self) -> str:
+        return self._manifest["inputs"]["song_title"]
+
+    @property
+    def cover_image(self) -> ImagePath:
+        return Path(self._manifest["inputs"]["cover_image"])
+
+    @property
+    def is_finished(self) -> bool:
+        return self._manifest.get("finished", False)
+
+    def mark_finished(self):
+        with self._lock:
+            self._manifest["finished"] = True
+            self._write_manifest()
+
+    @property
+    def attempts(self) -> int:
+        """
+        Сколько раз задачу запускали с текущими входными данными. 0 - задача ещё не отправлена на выполнение
+        """
+        return self._manifest.get("attempts", 0)
+
+    @property
+    def error(self) -> str | None:
+        return self._manifest.get("error")
+
+    def mark_started(self):
+        with self._lock:
+            self._manifest["attempts"] = self.attempts + 1
+            self._manifest["error"] = None
+            self._write_manifest()
+
+    def mark_failed(self, error: str):
+        with self._lock:
+            self._manifest["error"] = error
+            self._write_manifest()
+
+    def mark_text_edited(self):
+        """
+        Запоминает, что текст песни в чекпоинте исправлен вручную
+        """
+        text = self.load(Stage.TEXT)
+        with self._lock:
+            self._manifest["edited_text"] = text_fingerprint(text) if text is not None else None
+            self._write_manifest()
+
+    @property
+    def edited_text_key(self) -> str | None:
+        """
+        Хеш исправленного вручную текста, пока он остаётся текстом задачи. Ключи стадий зависят только
+        от входных данных, поэтому видео с исправленным текстом нужно отличать от видео с найденным
+        """
+        fingerprint = self._manifest.get("edited_text")
+        if fingerprint is None:
+            return None
+        text = self.load(Stage.TEXT)
+        return fingerprint if text is not None and text_fingerprint(text) == fingerprint else None
+
+    @property
+    def job_key(self) -> str:
+        """
+        Одинаковый для задач с одинаковыми аудио, названием и обложкой
+        """
+        return self.stage_key(Stage.RENDERING)
+
+    def stage_key(self, stage: Stage) -> str:
+        digest = hashlib.sha256(stage.value.encode())
+        for name in STAGE_INPUTS[stage]:
+            digest.update(self._input_fingerprints[name].encode())
+        for dependency in STAGE_DEPENDENCIES[stage]:
+            digest.update(self.stage_key(dependency).encode())
+        return digest.hexdigest()
+
+    def load(self, stage: Stage) -> Any | None:
+        entry = self._manifest["stages"].get(stage.value)
+        if entry is None or entry["key"] != self.stage_key(stage):
+            return None
+        artifacts = {name: self.job_dir / file_name for name, file_name in entry["artifacts"].items()}
+        if not all(path.exists() for path in artifacts.values()):
+            return None
+        match entry["type"]:
+            case "text":
+                return artifacts["text"].read_text(encoding="utf8")
+            case "separation":
+                return SeparationResult(vocals=artifacts["vocals"], back_track=artifacts["back_track"])
+            case "phrases":
+                return from_binary(artifacts["phrases"])
+            case "video":
+                return VideoPath(artifacts["video"])
+        return None
+
+    def save(self, stage: Stage, result: Any) -> Any:
+        if isinstance(result, str):
+            result_type = "text"
+            artifacts = {"text": f"{stage.value}.txt"}
+            (self.job_dir / artifacts["text"]).write_text(result, encoding="utf8")
+        elif isinstance(result, SeparationResult):
+            result_type = "separation"
+            vocals = self._move_into_job_dir(result.vocals, f"vocals{result.vocals.suffix}")
+            back_track = self._move_into_job_dir(result.back_track, f"accompaniment{result.back_track.suffix}")
+            artifacts = {"vocals": vocals.name, "back_track": back_track.name}
+            result = SeparationResult(vocals=vocals, back_track=back_track)
+        elif isinstance(result, list):
+            result_type = "phrases"
+            artifacts = {"phrases": f"{stage.value}{BINARY_SUFFIX}"}
+            save_to_binary(result, self.job_dir / artifacts["phrases"])
+        elif isinstance(result, Path):
+            result_type = "video"
+            result = self._move_into_job_dir(result, f"{stage.value}{result.suffix}")
+            artifacts = {"video": result.name}
+        else:
+            raise TypeError(f"Неизвестный результат стадии {stage}: {type(result)}")
+
+        with self._lock:
+            self._manifest["stages"][stage.value] = {
+                "key": self.stage_key(stage),
+                "type": result_type,
+                "artifacts": artifacts,
+            }
+            self._write_manifest()
+        return result
+
+    def export_stage(self, stage: Stage, destination: Path) -> None:
+        """
+        Копирует результаты выполненной стадии и их описание в папку destination
+        """
+        if self.load(stage) is None:
+            raise SerializationError(f"Стадия {stage.value} не выполнена")
+        entry = self._manifest["stages"][stage.value]
+        destination.mkdir(parents=True, exist_ok=True)
+        for file_name in entry["artifacts"].values():
+            shutil.copy2(self.job_dir / file_name, destination / file_name)
+        with open(destination / STAGE_ENTRY_NAME, "w", encoding="utf8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2)
+
+    def import_stage(self, stage: Stage, source: Path) -> None:
+        """
+        Добавляет в задачу стадию, экспортированную из задачи с теми же входными данными
+        """
+        with open(source / STAGE_ENTRY_NAME, encoding="utf8") as f:
+            entry = json.load(f)
+        if entry["key"] != self.stage_key(stage):
+            raise SerializationError(f"Стадия {stage.value} получена для других входных данных")
+        for file_name in entry["artifacts"].values():
+            shutil.copy2(source / file_name, self.job_dir / file_name)
+        with self._lock:
+            self._manifest["stages"][stage.value] = entry
+            self._write_manifest()
+
+    def evict(self, stage: Stage) -> None:
+        """
+        Удаляет результаты стадии, например видео, которое уже можно отправить по file_id
+        """
+        with self._lock:
+            entry = self._manifest["stages"].pop(stage.value, None)
+            if entry is None:
+                return
+            self._write_manifest()
+        for file_name in entry["artifacts"].values():
+            (self.job_dir / file_name).unlink(missing_ok=True)
+
+    def _move_into_job_dir(self, path: Path, name: str) -> Path:
+        destination = self.job_dir / name
+        if path.resolve() != destination.resolve():
+            shutil.move(path, destination)
+        return destination
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.job_dir / MANIFEST_NAME, encoding="utf8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            manifest = {"version": MANIFEST_VERSION, "stages": {}}
+        return manifest
+
+    def _write_manifest(self):
+        temporary = self.job_dir / f"{MANIFEST_NAME}.tmp"
+        with open(temporary, "w", encoding="utf8") as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temporary, self.job_dir / MANIFEST_NAME)
@@ -0,0 +1,42 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from core.application.delivery import FileIdIndex
+
+
+class JsonFileIdIndex(FileIdIndex):
+    """
+    Индекс в JSON-файле. Файл перезаписывается целиком при каждом изменении
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf8") as f:
+                self._file_ids: dict[str, str] = json.load(f)
+        except (OSError, ValueError):
+            self._file_ids = {}
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            return self._file_ids.get(key)
+
+    def put(self, key: str, file_id: str) -> None:
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._write()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if self._file_ids.pop(key, None) is not None:
+                self._write()
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        with open(temporary, "w", encoding="utf8") as f:
+            json.dump(self._file_ids, f, indent=2)
+        os.replace(temporary, self.path)
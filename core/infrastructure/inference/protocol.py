@@ -0,0 +1,45 @@
+import json
+import socket
+import struct
+
+from core.application.exceptions import InferenceError
+
+# Сообщение - длина тела (4 байта, big-endian) и тело в JSON.
+# Тензоры не передаются: сервер и клиенты на одной машине и обмениваются путями к файлам
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+def send_message(connection: socket.socket, message: dict) -> None:
+    body = json.dumps(message, ensure_ascii=False).encode("utf8")
+    connection.sendall(HEADER.pack(len(body)) + body)
+
+
+def receive_message(connection: socket.socket) -> dict | None:
+    """
+    Следующее сообщение или None, если собеседник закрыл соединение между сообщениями
+    """
+    header = _receive_exactly(connection, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise InferenceError(f"Слишком большое сообщение: {size} байт")
+    body = _receive_exactly(connection, size)
+    if body is None:
+        raise InferenceError("Соединение закрыто посреди сообщения")
+    return json.loads(body)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes | None:
+    chunks = []
+    received = 0
+    while received < size:
+        chunk = connection.recv(min(size - received, 1 << 20))
+        if not chunk:
+            if received:
+                raise InferenceError("Соединение закрыто посреди сообщения")
+            return None
+        chunks.append(chunk)
+        received += len(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,70 @@
+import socket
+from pathlib import Path
+
+from core.application.dto import AudioPath
+from core.application.exceptions import InferenceError
+from core.application.separation import AudioSeparator, SeparationResult
+from core.application.voice_recognition import Phrase, VoiceRecognizer
+from core.infrastructure.inference.protocol import receive_message, send_message
+from core.infrastructure.phrase_storage.json_format import from_json_data
+
+# Сколько ждать ответа сервера моделей, секунды. С запасом на очередь из нескольких длинных песен,
+# но задача не должна висеть вечно, если сервер завис
+CALL_TIMEOUT = 30 * 60
+
+
+def call(socket_path: Path, request: dict, timeout: float = CALL_TIMEOUT) -> dict:
+    """
+    Отправляет запрос серверу моделей и ждёт ответа. Соединение на каждый запрос:
+    запросы долгие, а сервер сам собирает одновременные запросы в пачки
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        try:
+            connection.connect(str(socket_path))
+        except OSError as e:
+            raise InferenceError(f"Сервер моделей {socket_path} недоступен: {e}") from e
+        try:
+            send_message(connection, request)
+            response = receive_message(connection)
+        except TimeoutError as e:
+            raise InferenceError(f"Сервер моделей не ответил за {timeout:g} с") from e
+        except OSError as e:
+            raise InferenceError(f"Соединение с сервером моделей прервано: {e}") from e
+    if response is None:
+        raise InferenceError("Сервер моделей закрыл соединение без ответа")
+    if "error" in response:
+        raise InferenceError(response["error"])
+    return response
+
+
+class RemoteSeparator(AudioSeparator):
+    """
+    Разделение на сервере моделей (core.presentation.inference_server). Пути передаются абсолютными,
+    потому что у сервера своя рабочая папка
+    """
+
+    def __init__(self, socket_path: Path, timeout: float = CALL_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def separate_into_vocals_and_music(self, audio_file: AudioPath, destination_folder: Path | None = None) -> SeparationResult:
+        if destination_folder is None:
+            destination_folder = Path("output") / audio_file.parent.name
+        response = call(self.socket_path, {
+            "method": "separate",
+            "audio_file": str(audio_file.resolve()),
+            "destination_folder": str(destination_folder.resolve()),
+        }, self.timeout)
+        return SeparationResult(vocals=Path(response["vocals"]), back_track=Path(response["back_track"]))
+
+
+class RemoteRecognizer(VoiceRecognizer):
+    def __init__(self, socket_path: Path, timeout: float = CALL_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def get_text_from_vocals(self, vocals: Path) -> list[Phrase]:
+        response = call(self.socket_path, {"method": "recognize", "vocals": str(vocals.resolve())},
+                        self.timeout)
+        return from_json_data(response["phrases"])
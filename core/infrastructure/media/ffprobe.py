@@ -0,0 +1,22 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+
+def probe_duration(path: Path) -> float | None:
+    """
+    Длительность медиафайла в секундах. Если ffprobe не установлен, длительность читает ffmpeg из moviepy
+    """
+    ffprobe = shutil.which("ffprobe")
+    try:
+        if ffprobe is None:
+            return float(ffmpeg_parse_infos(str(path))["duration"])
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)],
+            capture_output=True, text=True, check=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError, TypeError):
+        return None
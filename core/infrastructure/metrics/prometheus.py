@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.application.metrics import MetricsRecorder, StageMeasurement
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы длительности стадий, секунды
+STAGE_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200)
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class PrometheusMetrics(MetricsRecorder):
+    """
+    Хранит метрики в памяти процесса, отдаёт их в текстовом формате Prometheus
+    и дублирует каждое событие в лог одной JSON-строкой
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_runs: dict[str, int] = defaultdict(int)
+        self._stage_wall: dict[str, float] = defaultdict(float)
+        self._stage_cpu: dict[str, float] = defaultdict(float)
+        self._stage_buckets: dict[str, list[int]] = defaultdict(lambda: [0] * len(STAGE_DURATION_BUCKETS))
+        self._stage_peak_rss: dict[str, int] = {}
+        self._render_audio: dict[str, float] = defaultdict(float)
+        self._render_frames: dict[str, int] = defaultdict(int)
+        self._queue_depth: dict[str, int] = {}
+        self._cache: dict[tuple[str, bool], int] = defaultdict(int)
+
+    def record_stage(self, measurement: StageMeasurement) -> None:
+        stage = measurement.stage.value
+        with self._lock:
+            self._stage_runs[stage] += 1
+            self._stage_wall[stage] += measurement.wall_time
+            self._stage_cpu[stage] += measurement.cpu_time
+            for i, bound in enumerate(STAGE_DURATION_BUCKETS):
+                if measurement.wall_time <= bound:
+                    self._stage_buckets[stage][i] += 1
+            self._stage_peak_rss[stage] = measurement.peak_rss
+        self._log("stage", stage=stage, wall_time=measurement.wall_time, cpu_time=measurement.cpu_time,
+                  peak_rss=measurement.peak_rss)
+
+    def record_render(self, name: str, audio_duration: float, frames: int) -> None:
+        with self._lock:
+            self._render_audio[name] += audio_duration
+            self._render_frames[name] += frames
+        self._log("render", name=name, audio_duration=audio_duration, frames=frames)
+
+    def set_queue_depth(self, queue: str, depth: int) -> None:
+        with self._lock:
+            self._queue_depth[queue] = depth
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            self._cache[(cache, hit)] += 1
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, metric_type: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            family("singalong_stage_runs_total", "counter", "Количество выполненных стадий")
+            for stage, value in self._stage_runs.items():
+                lines.append(f"singalong_stage_runs_total{{{_labels(stage=stage)}}} {value}")
+            family("singalong_stage_cpu_seconds_total", "counter", "Процессорное время стадий")
+            for stage, value in self._stage_cpu.items():
+                lines.append(f"singalong_stage_cpu_seconds_total{{{_labels(stage=stage)}}} {value}")
+            family("singalong_stage_wall_seconds", "histogram", "Время выполнения стадий")
+            for stage, buckets in self._stage_buckets.items():
+                for bound, count in zip(STAGE_DURATION_BUCKETS, buckets):
+                    lines.append(f"singalong_stage_wall_seconds_bucket{{{_labels(stage=stage, le=str(bound))}}} {count}")
+                lines.append(
+                    f"singalong_stage_wall_seconds_bucket{{{_labels(stage=stage, le='+Inf')}}} {self._stage_runs[stage]}"
+                )
+                lines.append(f"singalong_stage_wall_seconds_sum{{{_labels(stage=stage)}}} {self._stage_wall[stage]}")
+                lines.append(f"singalong_stage_wall_seconds_count{{{_labels(stage=stage)}}} {self._stage_runs[stage]}")
+            family("singalong_stage_peak_rss_bytes", "gauge", "Пиковая память процесса во время последней стадии")
+            for stage, value in self._stage_peak_rss.items():
+                lines.append(f"singalong_stage_peak_rss_bytes{{{_labels(stage=stage)}}} {value}")
+            family("singalong_render_audio_seconds_total", "counter", "Длительность отрисованного звука")
+            for name, value in self._render_audio.items():
+                lines.append(f"singalong_render_audio_seconds_total{{{_labels(name=name)}}} {value}")
+            family("singalong_render_frames_total", "counter", "Количество отрисованных кадров")
+            for name, value in self._render_frames.items():
+                lines.append(f"singalong_render_frames_total{{{_labels(name=name)}}} {value}")
+            family("singalong_queue_depth", "gauge", "Количество задач в очереди")
+            for queue, value in self._queue_depth.items():
+                lines.append(f"singalong_queue_depth{{{_labels(queue=queue)}}} {value}")
+            family("singalong_cache_requests_total", "counter", "Обращения к кешам")
+            for (cache, hit), value in self._cache.items():
+                lines.append(
+                    f"singalong_cache_requests_total{{{_labels(cache=cache, result='hit' if hit else 'miss')}}} {value}"
+                )
+            family("singalong_cache_hit_ratio", "gauge", "Доля попаданий в кеш")
+            for cache in {cache for cache, _ in self._cache}:
+                hits = self._cache[(cache, True)]
+                total = hits + self._cache[(cache, False)]
+                lines.append(f"singalong_cache_hit_ratio{{{_labels(cache=cache)}}} {hits / total}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Запускает в фоновом потоке HTTP-сервер с метриками на /metrics
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+        return server
+
+    def _log(self, event: str, **fields):
+        logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False))
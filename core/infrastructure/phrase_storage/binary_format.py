@@ -0,0 +1,144 @@
+import json
+import struct
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from core.application.exceptions import SerializationError
+from core.application.phrase_timeline import PhraseTimeline, VOWELS, vowel_weights
+from core.application.voice_recognition import Phrase
+from core.infrastructure.phrase_storage.json_format import from_json, save_to_json
+
+# Формат файла (little-endian):
+#   заголовок: magic, версия, число фраз, число слов, длина таблицы строк в символах
+#   float64[фразы]  начала фраз
+#   float64[фразы]  концы фраз
+#   float64[слова]  начала слов
+#   float64[слова]  концы слов
+#   int64[фразы+1]  смещения слов фраз
+#   int64[фразы+слова+1]  смещения строк (сначала тексты фраз, затем слова) в таблице строк
+#   utf-8  таблица строк
+# Все массивы выровнены по 8 байт, поэтому файл можно читать через mmap без копирования
+MAGIC = b"SAPH"
+VERSION = 1
+BINARY_SUFFIX = ".phrases"
+_HEADER = struct.Struct("<4sHxxQQQ")
+
+
+def _arrays_layout(phrases_count: int, words_count: int) -> list[tuple[str, np.dtype, int]]:
+    return [
+        ("phrase_starts", np.dtype("<f8"), phrases_count),
+        ("phrase_ends", np.dtype("<f8"), phrases_count),
+        ("starts", np.dtype("<f8"), words_count),
+        ("ends", np.dtype("<f8"), words_count),
+        ("word_offsets", np.dtype("<i8"), phrases_count + 1),
+        ("string_offsets", np.dtype("<i8"), phrases_count + words_count + 1),
+    ]
+
+
+def save_to_binary(phrases: list[Phrase] | PhraseTimeline, filename: str | Path):
+    timeline = phrases if isinstance(phrases, PhraseTimeline) else PhraseTimeline.from_phrases(phrases)
+    strings = timeline.texts + timeline.words
+    string_lengths = np.fromiter((len(string) for string in strings), dtype=np.int64, count=len(strings))
+    string_offsets = np.concatenate(([0], np.cumsum(string_lengths)))
+    string_table = "".join(strings)
+    arrays = {
+        "phrase_starts": timeline.phrase_starts,
+        "phrase_ends": timeline.phrase_ends,
+        "starts": timeline.starts,
+        "ends": timeline.ends,
+        "word_offsets": timeline.word_offsets,
+        "string_offsets": string_offsets,
+    }
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(timeline), timeline.word_count, len(string_table)))
+        for name, dtype, _ in _arrays_layout(len(timeline), timeline.word_count):
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.write(string_table.encode("utf-8"))
+
+
+def timeline_from_binary(filename: str | Path, use_mmap: bool = True, vowels: str = VOWELS) -> PhraseTimeline:
+    """
+    Числовые массивы при use_mmap отображаются из файла в режиме copy-on-write:
+    их можно менять, файл при этом не перезаписывается
+    """
+    # Размер проверяется до отображения: пустой файл mmap не отображает вовсе,
+    # а из обрезанного получились бы укороченные массивы
+    file_size = Path(filename).stat().st_size
+    if file_size < _HEADER.size:
+        raise SerializationError(f"{filename}: файл слишком короткий")
+    with open(filename, "rb") as f:
+        header = f.read(_HEADER.size)
+    magic, version, phrases_count, words_count, string_table_length = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise SerializationError(f"{filename}: неизвестный формат")
+    if version != VERSION:
+        raise SerializationError(f"{filename}: неподдерживаемая версия формата {version}")
+    layout = _arrays_layout(phrases_count, words_count)
+    arrays_end = _HEADER.size + sum(dtype.itemsize * count for _, dtype, count in layout)
+    # В UTF-8 символ занимает хотя бы байт
+    if file_size < arrays_end + string_table_length:
+        raise SerializationError(f"{filename}: файл обрезан")
+
+    if use_mmap:
+        buffer = np.memmap(filename, dtype=np.uint8, mode="c")
+    else:
+        buffer = np.fromfile(filename, dtype=np.uint8)
+    arrays = {}
+    offset = _HEADER.size
+    for name, dtype, count in layout:
+        size = dtype.itemsize * count
+        arrays[name] = buffer[offset:offset + size].view(dtype)
+        offset += size
+    try:
+        string_table = buffer[offset:].tobytes().decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise SerializationError(f"{filename}: повреждена таблица строк") from e
+    if len(string_table) != string_table_length:
+        raise SerializationError(f"{filename}: повреждена таблица строк")
+
+    string_offsets = arrays.pop("string_offsets").tolist()
+    strings = [string_table[string_offsets[i]:string_offsets[i + 1]] for i in range(len(string_offsets) - 1)]
+    words = strings[phrases_count:]
+    word_offsets = arrays["word_offsets"]
+    return PhraseTimeline(
+        texts=strings[:phrases_count],
+        words=words,
+        weights=vowel_weights(words, vowels),
+        phrase_index=np.repeat(np.arange(phrases_count, dtype=np.int64), np.diff(word_offsets)),
+        **arrays,
+    )
+
+
+def from_binary(filename: str | Path) -> list[Phrase]:
+    return timeline_from_binary(filename).to_phrases()
+
+
+if __name__ == "__main__":
+    # Сравнение с JSON на песнях из media
+    repeats = 20
+    output_folder = Path("output")
+    output_folder.mkdir(exist_ok=True)
+    for song_folder in sorted(Path("media").iterdir()):
+        for name in ("transcribe", "linking"):
+            json_file = song_folder / f"{name}.json"
+            phrases = from_json(json_file)
+            json_copy = output_folder / f"{name}.json"
+            binary_copy = output_folder / f"{name}{BINARY_SUFFIX}"
+            save_to_binary(phrases, binary_copy)
+            assert from_binary(binary_copy) == phrases
+            timings = {
+                "json save": timeit.timeit(lambda: save_to_json(phrases, json_copy), number=repeats),
+                "json load": timeit.timeit(lambda: from_json(json_copy), number=repeats),
+                "binary save": timeit.timeit(lambda: save_to_binary(phrases, binary_copy), number=repeats),
+                "binary load": timeit.timeit(lambda: from_binary(binary_copy), number=repeats),
+                "binary load (timeline)": timeit.timeit(lambda: timeline_from_binary(binary_copy), number=repeats),
+            }
+            sizes = {"json": json_copy.stat().st_size, "binary": binary_copy.stat().st_size}
+            print(json.dumps({
+                "song": song_folder.name,
+                "file": name,
+                "ms": {key: round(value / repeats * 1000, 3) for key, value in timings.items()},
+                "bytes": sizes,
+            }, ensure_ascii=False))
@@ -0,0 +1,34 @@
+import dataclasses
+import json
+from pathlib import Path
+
+from adaptix import Retort
+
+from core.application.voice_recognition import Phrase
+
+_retort = Retort(strict_coercion=False)
+
+
+class EnhancedJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if dataclasses.is_dataclass(o):
+            return dataclasses.asdict(o)
+        return super().default(o)
+
+
+def save_to_json(phrases: list[Phrase], filename: str | Path):
+    with open(filename, 'w') as f:
+        json.dump(phrases, f, cls=EnhancedJSONEncoder)
+
+
+def from_json(filename: str | Path) -> list[Phrase]:
+    with open(filename, 'r') as f:
+        return from_json_data(json.load(f))
+
+
+def to_json_data(phrases: list[Phrase]) -> list[dict]:
+    return [dataclasses.asdict(phrase) for phrase in phrases]
+
+
+def from_json_data(data: list[dict]) -> list[Phrase]:
+    return _retort.load(data, list[Phrase])
@@ -0,0 +1,71 @@
+import cProfile
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from core.application.job import Stage, StageProfiler
+
+
+class StackSampler:
+    """
+    Раз в interval секунд снимает стек указанного потока и копит свёрнутые стеки
+    в формате flamegraph.pl/speedscope: "module:function;module:function count"
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, path: Path):
+        with open(path, "w", encoding="utf8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{frame.f_globals.get('__name__', code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self._stacks[";".join(reversed(names))] += 1
+
+
+class PythonStageProfiler(StageProfiler):
+    """
+    Детерминированный профиль cProfile (<stage>.prof, открывается snakeviz/pstats)
+    и сэмплированные стеки для флеймграфа (<stage>.folded)
+    """
+
+    def __init__(self, sampling_interval: float = 0.005):
+        self.sampling_interval = sampling_interval
+
+    @contextmanager
+    def profile(self, stage: Stage, destination: Path) -> Iterator[None]:
+        destination.mkdir(parents=True, exist_ok=True)
+        sampler = StackSampler(threading.get_ident(), self.sampling_interval)
+        profiler = cProfile.Profile()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            sampler.stop()
+            profiler.dump_stats(destination / f"{stage.value}.prof")
+            sampler.dump(destination / f"{stage.value}.folded")
@@ -9,11 +9,33 @@ from core.application.dto import AudioPath
 
 
 class SpleeterSeparator(AudioSeparator):
+    def __init__(self):
+        self._separator: Separator | None = None
+
+    @property
+    def separator(self) -> Separator:
+        # Модель загружается один раз на экземпляр, при первом разделении
+        if self._separator is None:
+            separation_params = "spleeter:2stems"
+            mwf = False
+            self._separator = Separator(
+                params_descriptor=separation_params,
+                MWF=mwf,
+            )
+        return self._separator
+
     def separate_into_vocals_and_music(self, audio_file: AudioPath, destination_folder: Path | None = None) -> SeparationResult:
-        if destination_folder is None:
-            destination_folder = Path("output")
-        separation_params = "spleeter:2stems"
-        mwf = False
+        result = self.separate_many([(audio_file, destination_folder)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def separate_many(self, requests: list[tuple[AudioPath, Path | None]]) -> list[SeparationResult | Exception]:
+        """
+        Разделяет несколько файлов за один проход: spleeter ставит их в свою очередь
+        и прогоняет через одну модель, пока читаются и пишутся соседние файлы.
+        Ошибка в одном файле не мешает остальным: вместо его результата возвращается исключение
+        """
         adapter = "spleeter.audio.ffmpeg.FFMPEGProcessAudioAdapter"
         audio_adapter: AudioAdapter = AudioAdapter.get(adapter)
         offset = 0
@@ -21,30 +43,58 @@ class SpleeterSeparator(AudioSeparator):
         bitrate = "128k" # todo
         codec = Codec.WAV
         filename_format = "{filename}/{instrument}.{codec}"
-        separator = Separator(
-            params_descriptor=separation_params,
-            MWF=mwf,
-        )
-        separator.separate_to_file(
-            str(audio_file),
-            str(destination_folder or Path("output")),
-            audio_adapter=audio_adapter,
-            offset=offset,
-            duration=duration,
-            codec=codec,
-            bitrate=bitrate,
-            filename_format=filename_format,
-            synchronous=False,
-        )
-        separator.join()
-        return SeparationResult(
-            vocals=Path(filename_format.format(
-                filename=destination_folder / audio_file.stem, instrument="vocals", codec=codec.value
-            )),
-            back_track=Path(filename_format.format(
-                filename=destination_folder / audio_file.stem, instrument="accompaniment", codec=codec.value
-            )),
-        )
+        separator = self.separator
+        results = []
+        for audio_file, destination_folder in requests:
+            if destination_folder is None:
+                # Файлы разных задач часто называются одинаково (audio.mp3), поэтому разводим их по папке задачи
+                destination_folder = Path("output") / audio_file.parent.name
+            try:
+                separator.separate_to_file(
+                    str(audio_file),
+                    str(destination_folder),
+                    audio_adapter=audio_adapter,
+                    offset=offset,
+                    duration=duration,
+                    codec=codec,
+                    bitrate=bitrate,
+                    filename_format=filename_format,
+                    synchronous=False,
+                )
+            except Exception as e:
+                results.append(e)
+                continue
+            results.append(SeparationResult(
+                vocals=Path(filename_format.format(
+                    filename=destination_folder / audio_file.stem, instrument="vocals", codec=codec.value
+                )),
+                back_track=Path(filename_format.format(
+                    filename=destination_folder / audio_file.stem, instrument="accompaniment", codec=codec.value
+                )),
+            ))
+        save_error = self._join(separator)
+        if save_error is not None:
+            # Какой файл не удалось записать, spleeter не сообщает: ошибка достаётся файлам, которых нет на диске
+            results = [
+                result if isinstance(result, Exception) or (result.vocals.exists() and result.back_track.exists())
+                else save_error
+                for result in results
+            ]
+        return results
+
+    @staticmethod
+    def _join(separator: Separator) -> Exception | None:
+        """
+        Дожидается записи всех файлов очереди. join прерывается на первой неудачной записи,
+        оставляя в очереди остальные, поэтому вызывается, пока не дождётся всех
+        """
+        error = None
+        while True:
+            try:
+                separator.join()
+                return error
+            except Exception as e:
+                error = e
 
 
 if __name__ == "__main__":
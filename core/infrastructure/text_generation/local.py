@@ -0,0 +1,19 @@
+from pathlib import Path
+
+from core.application.text_generation import TextGenerator
+
+
+class LocalTextScrapper(TextGenerator):
+    """
+    Берёт текст песни из файла, если он известен заранее, иначе обращается к fallback
+    """
+
+    def __init__(self, lyrics: dict[str, Path], fallback: TextGenerator):
+        self.lyrics = lyrics
+        self.fallback = fallback
+
+    def get_text_for_a_song(self, song_title: str) -> str:
+        lyrics_file = self.lyrics.get(song_title)
+        if lyrics_file is None:
+            return self.fallback.get_text_for_a_song(song_title)
+        return lyrics_file.read_text(encoding="utf8")
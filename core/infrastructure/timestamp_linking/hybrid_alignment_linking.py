@@ -0,0 +1,120 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from core.application.phrase_timeline import PhraseTimeline, UNKNOWN_END, UNKNOWN_START
+from core.application.timestamp_linking import TimestampLinker
+from core.application.voice_recognition import Phrase
+from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
+from core.infrastructure.timestamp_linking.text_alignment_linking import TextAlignmentLinker, TextStorage
+
+logger = logging.getLogger(__name__)
+
+
+class HybridAlignmentLinker(TimestampLinker):
+    """
+    Одно выравнивание всего текста (TextAlignmentLinker), а поиск окна слов для отдельной строки
+    (WordGrabberTextAlignmentLinker) - только для строк, выровненных ненадёжно.
+
+    Как и в WordGrabberTextAlignmentLinker, строки разбираются по порядку и забирают распознанные слова.
+    Строка надёжна, если для большей части её слов нашлась пара и эти пары идут подряд сразу за словами
+    предыдущей строки. Остальные строки ищутся в словах до следующей надёжной строки
+    """
+    # Строка надёжна, если для такой доли её слов нашлась пара среди распознанных
+    MIN_LINE_CONFIDENCE = 0.5
+    # Сколько лишних распознанных слов может оказаться перед надёжной строкой и внутри неё
+    MAX_SKIPPED_WORDS = WordGrabberTextAlignmentLinker.MIN_WORDS_TO_SKIP
+
+    def __init__(self):
+        self.global_linker = TextAlignmentLinker()
+        self.local_linker = WordGrabberTextAlignmentLinker()
+
+    def link_timestamps_to_song_text(self, full_text: str, phrases: list[Phrase]) -> list[Phrase]:
+        storage = self.global_linker.align(full_text, phrases)
+        timeline = storage.timeline
+        first_sources, last_sources = self.line_sources(storage)
+        spans = last_sources - first_sources + 1
+        candidates = (
+                (self.line_confidence(timeline) >= self.MIN_LINE_CONFIDENCE)
+                & (spans <= np.diff(timeline.word_offsets) + self.MAX_SKIPPED_WORDS)
+        )
+
+        words = [word for phrase in phrases for word in phrase.words]
+        offsets = timeline.word_offsets.tolist()
+        cursor = 0
+        searched = found = 0
+        for line, text in enumerate(timeline.texts):
+            line_words = slice(offsets[line], offsets[line + 1])
+            if line_words.start == line_words.stop:
+                continue
+            if candidates[line] and 0 <= first_sources[line] - cursor < self.MAX_SKIPPED_WORDS:
+                cursor = int(last_sources[line]) + 1
+                continue
+
+            searched += 1
+            window_end = self.next_anchor(candidates, first_sources, line, cursor, len(words))
+            match = self.local_linker.find_line_words(text, words[:window_end], cursor)
+            phrase = None
+            if match is not None:
+                phrase = self.local_linker.match_words_timestamps(text, [match.to_phrase()])
+            if phrase is None or len(phrase.words) != line_words.stop - line_words.start:
+                # Пары из общего выравнивания у такой строки ненадёжны, её тайминги будут интерполированы
+                timeline.starts[line_words] = UNKNOWN_START
+                timeline.ends[line_words] = UNKNOWN_END
+                continue
+            timeline.starts[line_words] = [word.start for word in phrase.words]
+            timeline.ends[line_words] = [word.end for word in phrase.words]
+            cursor += match.skipped + len(match.words)
+            found += 1
+
+        logger.debug("Строк %d, заново искались %d, найдены %d", len(timeline), searched, found)
+
+        timeline.interpolate_gaps(timeline.unknown_words(), head_start=phrases[0].start, tail_end=phrases[-1].end)
+        timeline.sync_phrase_bounds()
+
+        return timeline.to_phrases()
+
+    def line_confidence(self, timeline: PhraseTimeline) -> np.ndarray:
+        """
+        Доля слов строки, для которых нашлась пара. У пустых строк - 1
+        """
+        known = np.bincount(timeline.phrase_index, weights=(~timeline.unknown_words()).astype(np.float64),
+                            minlength=len(timeline))
+        counts = np.diff(timeline.word_offsets)
+        return np.divide(known, counts, out=np.ones(len(timeline)), where=counts > 0)
+
+    def line_sources(self, storage: TextStorage) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Первое и последнее распознанное слово, сопоставленное словам строки.
+        У строк без пар первое слово - максимальное целое, последнее - -1
+        """
+        timeline = storage.timeline
+        matched = storage.first_sources >= 0
+        first = np.full(len(timeline), np.iinfo(np.int64).max)
+        last = np.full(len(timeline), -1, dtype=np.int64)
+        np.minimum.at(first, timeline.phrase_index[matched], storage.first_sources[matched])
+        np.maximum.at(last, timeline.phrase_index[matched], storage.last_sources[matched])
+        return first, last
+
+    def next_anchor(self, candidates: np.ndarray, first_sources: np.ndarray, line: int, cursor: int,
+                    word_count: int) -> int:
+        """
+        Первое распознанное слово ближайшей следующей строки, выровненной после cursor.
+        Окно поиска строки заканчивается на нём
+        """
+        for next_line in range(line + 1, len(candidates)):
+            if candidates[next_line] and cursor < first_sources[next_line] < word_count:
+                return int(first_sources[next_line])
+        return word_count
+
+
+if __name__ == '__main__':
+    from core.infrastructure.phrase_storage.json_format import from_json
+
+    song_folder = Path("media") / "Немного нервно - Пожар"
+    with open(song_folder / "original_text.txt") as f:
+        song_text = f.read()
+    phrases = HybridAlignmentLinker().link_timestamps_to_song_text(song_text, from_json(song_folder / "transcribe.json"))
+    for phrase in phrases:
+        print(f"{phrase.start:7.2f} {phrase.end:7.2f} {phrase.text}")
@@ -0,0 +1,63 @@
+import numpy as np
+
+from core.application.phrase_timeline import PhraseTimeline
+from core.application.timestamp_linking import diff_lines, IncrementalLinker
+from core.application.voice_recognition import Phrase
+from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
+
+
+class IncrementalAlignmentLinker(IncrementalLinker):
+    """
+    Разметка после исправления текста. Неизменённые строки сохраняют прежние тайминги,
+    изменённые ищутся (как в WordGrabberTextAlignmentLinker) только среди распознанных слов
+    между соседними неизменёнными строками. Строки, которые не нашлись, интерполируются внутри этого промежутка
+    """
+
+    def __init__(self):
+        self.local_linker = WordGrabberTextAlignmentLinker()
+
+    def relink(self, full_text: str, previous_text: str, previous_phrases: list[Phrase],
+               phrases: list[Phrase]) -> list[Phrase]:
+        if len(previous_phrases) != len(previous_text.split("\n")):
+            # Прежняя разметка сделана для другого деления на строки, сопоставить их нельзя
+            return self.local_linker.link_timestamps_to_song_text(full_text, phrases)
+
+        lines = full_text.split("\n")
+        previous_lines = diff_lines(previous_text, full_text)
+        words = [word for phrase in phrases for word in phrase.words]
+        word_starts = np.fromiter((word.start for word in words), dtype=np.float64, count=len(words))
+
+        result = []
+        cursor = 0
+        for line, text in enumerate(lines):
+            previous_line = previous_lines[line]
+            if previous_line is not None:
+                phrase = previous_phrases[previous_line]
+                result.append(phrase)
+                if phrase.words:
+                    cursor = max(cursor, int(np.searchsorted(word_starts, phrase.end)))
+                continue
+
+            window_end = self.next_anchor(previous_lines, previous_phrases, word_starts, line)
+            match = self.local_linker.find_line_words(text, words[:window_end], cursor)
+            if match is None:
+                result.append(self.local_linker.gen_empty_phrase(text))
+                continue
+            result.append(self.local_linker.match_words_timestamps(text, [match.to_phrase()]))
+            cursor += match.skipped + len(match.words)
+
+        timeline = PhraseTimeline.from_phrases(result, self.local_linker.vowels)
+        timeline.interpolate_gaps(timeline.unknown_words(), head_start=phrases[0].start, tail_end=phrases[-1].end)
+        timeline.sync_phrase_bounds()
+
+        return timeline.to_phrases()
+
+    def next_anchor(self, previous_lines: list[int | None], previous_phrases: list[Phrase], word_starts: np.ndarray,
+                    line: int) -> int:
+        """
+        Первое распознанное слово следующей неизменённой строки. Окно поиска строки заканчивается на нём
+        """
+        for previous_line in previous_lines[line + 1:]:
+            if previous_line is not None and previous_phrases[previous_line].words:
+                return int(np.searchsorted(word_starts, previous_phrases[previous_line].start))
+        return len(word_starts)
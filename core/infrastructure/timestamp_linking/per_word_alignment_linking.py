@@ -1,14 +1,15 @@
 import json
-import math
+from dataclasses import dataclass
 from difflib import SequenceMatcher
 from pathlib import Path
 
 import adaptix
 
+from core.application.phrase_timeline import EN_VOWELS, PhraseTimeline, RU_VOWELS, UNKNOWN_END, UNKNOWN_START, VOWELS
 from core.application.timestamp_linking import TimestampLinker
 from core.application.voice_recognition import Phrase, Word
 from core.infrastructure.timestamp_linking.text_alignment_linking import TextAlignmentLinker
-from core.infrastructure.voice_recognition.whisper_ai import save_to_json
+from core.infrastructure.phrase_storage.json_format import save_to_json
 
 
 class bcolors:
@@ -37,14 +38,30 @@ def visualize_diff(matcher, a, b):
     return ''.join(result)
 
 
+@dataclass
+class LineMatch:
+    ratio: float
+    skipped: int
+    words: list[Word]
+
+    @property
+    def text(self) -> str:
+        return " ".join([word.word.strip() for word in self.words])
+
+    def to_phrase(self) -> Phrase:
+        return Phrase(text=self.text, start=self.words[0].start, end=self.words[-1].end, words=self.words)
+
+
 class WordGrabberTextAlignmentLinker(TimestampLinker):
     MAX_PHRASES_TO_SKIP = 6
     MAX_TOLERANCE = 0.6
     MAX_WORDS_PER_LINE = 50
+    MIN_WORDS_TO_SKIP = 5
+    MAX_WORDS_TO_SKIP = 54
 
-    en_vowels = "aeiouу"
-    ru_vowels = "еыаоэяию"
-    vowels = en_vowels + ru_vowels
+    en_vowels = EN_VOWELS
+    ru_vowels = RU_VOWELS
+    vowels = VOWELS
 
     def vowels_count(self, word: str) -> int:
         return sum(map(lambda x: x in self.vowels, word))
@@ -59,31 +76,33 @@ class WordGrabberTextAlignmentLinker(TimestampLinker):
         return phrase
 
     def gen_empty_phrase(self, line: str) -> Phrase:
-        return Phrase(line, math.inf, -1, [Word(word, math.inf, -1) for word in line.split()])
-
-    def split_time_by_phrases(self, phrases: list[Phrase], start: float, end: float):
-        phrases_weight = [sum([max(self.vowels_count(word.word), 1) for word in phrase.words]) for phrase in phrases]
-        total_weight = sum(phrases_weight)
-        time_delta = end - start
-        var = start
-        for unknown_phrase, weight in zip(phrases, phrases_weight):
-            unknown_phrase.start = var
-            var += time_delta * weight / total_weight
-            unknown_phrase.end = var
-            self.fill_timestamp_spaces(unknown_phrase)
-
-    def fill_timestamp_spaces(self, phrase: Phrase):
-        assert phrase.start != math.inf and phrase.end != -1, phrase
-        words_weight = [max(self.vowels_count(word.word), 1) for word in phrase.words]
-        start = phrase.start
-        end = phrase.end
-        time_delta = end - start
-        total_weight = sum(words_weight)
-        var = start
-        for unknown_word, weight in zip(phrase.words, words_weight):
-            unknown_word.start = var
-            var += time_delta * weight / total_weight
-            unknown_word.end = var
+        return Phrase(line, UNKNOWN_START, UNKNOWN_END, [Word(word, UNKNOWN_START, UNKNOWN_END) for word in line.split()])
+
+    def find_line_words(self, line: str, words: list[Word], first_word: int = 0) -> LineMatch | None:
+        """
+        Ищет среди слов, начиная с first_word, окно подряд идущих слов, больше всего похожее на строку.
+        Сначала пропускается не больше MIN_WORDS_TO_SKIP слов, и, пока похожего окна нет, допустимый пропуск растёт.
+        Возвращает None, если похожего окна нет
+        """
+        ratios = dict()
+        for words_to_skip in range(self.MAX_WORDS_TO_SKIP):
+            for words_to_take in range(self.MAX_WORDS_PER_LINE):
+                if first_word + words_to_skip + words_to_take >= len(words):
+                    continue
+                current_words = words[first_word + words_to_skip:first_word + words_to_skip + words_to_take]
+                current_text = " ".join([word.word.strip() for word in current_words])
+                matcher = SequenceMatcher(None, line, current_text)
+                ratio = matcher.ratio()
+                # При равной похожести остаётся окно с наименьшим пропуском
+                if ratio not in ratios:
+                    ratios[ratio] = (words_to_skip, current_words)
+            if words_to_skip + 1 < self.MIN_WORDS_TO_SKIP or not ratios:
+                continue
+            best_ratio = max(ratios)
+            if best_ratio > self.MAX_TOLERANCE:
+                skipped, current_words = ratios[best_ratio]
+                return LineMatch(best_ratio, skipped, current_words)
+        return None
 
     def link_timestamps_to_song_text(self, full_text: str, phrases: list[Phrase]) -> list[Phrase]:
         missing = 0
@@ -94,52 +113,25 @@ class WordGrabberTextAlignmentLinker(TimestampLinker):
         words = sum([phrase.words for phrase in phrases], start=[])
         first_unreclaimed_word = 0
         for full_text_line in full_text.split('\n'):
-            for max_words_to_skip in range(5, 55):
-                ratios = dict()
-                # print(words[first_unreclaimed_word])
-                for words_to_skip in range(max_words_to_skip):
-                    for words_to_take in range(self.MAX_WORDS_PER_LINE):
-                        if first_unreclaimed_word + words_to_skip + words_to_take >= len(words):
-                            continue
-                        current_words = words[
-                                        first_unreclaimed_word + words_to_skip:first_unreclaimed_word + words_to_skip + words_to_take
-                                        ]
-                        current_text = " ".join([word.word.strip() for word in current_words])
-                        matcher = SequenceMatcher(None, full_text_line, current_text)
-                        ratio = matcher.ratio()
-                        if ratio not in ratios:
-                            ratios[ratio] = (words_to_skip, words_to_take, current_text, current_words)
-                        else:
-                            old_ratio = ratios[ratio]
-                            if words_to_skip < old_ratio[0]:
-                                ratios[ratio] = (words_to_skip, words_to_take, current_text)
-                best_ratio = max(ratios)
-                best = ratios[best_ratio]
-                words_to_skip, words_to_take, current_text, current_words = best
-                if best_ratio > self.MAX_TOLERANCE:
-                    print(f"{bcolors.OKBLUE}{full_text_line} | {current_text} | { best_ratio=} {words_to_skip=} {words_to_take=}{bcolors.ENDC}")
-                    first_unreclaimed_word += words_to_skip + words_to_take
-                    found += 1
-                    result.append(self.match_words_timestamps(full_text_line, [Phrase(text=current_text, start=current_words[0].start, end=current_words[-1].end, words=current_words)]))
-                    break
+            match = self.find_line_words(full_text_line, words, first_unreclaimed_word)
+            if match is not None:
+                print(f"{bcolors.OKBLUE}{full_text_line} | {match.text} | best_ratio={match.ratio} "
+                      f"words_to_skip={match.skipped} words_to_take={len(match.words)}{bcolors.ENDC}")
+                first_unreclaimed_word += match.skipped + len(match.words)
+                found += 1
+                result.append(self.match_words_timestamps(full_text_line, [match.to_phrase()]))
             else:
                 result.append(self.gen_empty_phrase(full_text_line))
                 print(f"{bcolors.RED}{full_text_line}{bcolors.ENDC}")
                 missing += 1
         print(f"{missing=} {found=} {first_unreclaimed_word=} {len(words)=}")
 
-        unknown_phrases = []
-        last_known_phrase = phrases[0]
-        for i, phrase in enumerate(result):
-            if phrase.start == math.inf and phrase.end == -1:
-                unknown_phrases.append(phrase)
-            else:
-                if unknown_phrases:
-                    self.split_time_by_phrases(unknown_phrases, last_known_phrase.end, phrase.start)
-                    unknown_phrases.clear()
-                last_known_phrase = phrase
+        timeline = PhraseTimeline.from_phrases(result, self.vowels)
+        unknown_words = timeline.phrase_words_mask(timeline.unknown_phrases())
+        timeline.interpolate_gaps(unknown_words, head_start=phrases[0].start, tail_end=phrases[-1].end)
+        timeline.sync_phrase_bounds()
 
-        return result
+        return timeline.to_phrases()
 
 
 if __name__ == '__main__':
@@ -3,9 +3,12 @@ from difflib import SequenceMatcher
 from pathlib import Path
 from string import punctuation
 
+import numpy as np
+
 from core.application.exceptions import RecognitionError
+from core.application.phrase_timeline import EN_VOWELS, PhraseTimeline, RU_VOWELS, VOWELS
 from core.application.timestamp_linking import TimestampLinker
-from core.application.voice_recognition import Phrase, Word
+from core.application.voice_recognition import Phrase
 
 
 def is_intersecting(a1, a2, b1, b2) -> bool:
@@ -20,37 +23,52 @@ def is_intersecting(a1, a2, b1, b2) -> bool:
 @dataclass
 class TextStorage:
     full_text: str
-    phrases: list[Phrase] = field(default_factory=list)
+    vowels: str = VOWELS
+    timeline: PhraseTimeline = field(init=False)
+    # Первое и последнее распознанное слово, сопоставленное слову текста (-1, если сопоставления нет)
+    first_sources: np.ndarray = field(init=False, repr=False)
+    last_sources: np.ndarray = field(init=False, repr=False)
+    _char_starts: np.ndarray = field(init=False, repr=False)
+    _char_ends: np.ndarray = field(init=False, repr=False)
 
     def __post_init__(self):
-        self.phrases = [Phrase(line, float('inf'), -1, [Word(word, float('inf'), -1) for word in line.split()])
-                        for line in self.full_text.splitlines()]
-
-    def get_word_by_index(self, index):
-        prev_end_i = -1
-        for phrase in self.phrases:
-            for word in phrase.words:
-                start_i, end_i = prev_end_i + 1, prev_end_i + 1 + len(word.word)
-                if start_i <= index <= end_i:
-                    return word
-                prev_end_i = end_i
-
-    def write_timecode(self, start_time, end_time, start_i, end_i):
+        self.timeline = PhraseTimeline.from_lines(self.full_text, self.vowels)
+        lengths = np.fromiter((len(word) for word in self.timeline.words), dtype=np.int64,
+                              count=self.timeline.word_count)
+        self._char_starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])).astype(np.int64)
+        self._char_ends = self._char_starts + lengths
+        self.first_sources = np.full(self.timeline.word_count, -1, dtype=np.int64)
+        self.last_sources = np.full(self.timeline.word_count, -1, dtype=np.int64)
+
+    def get_word_by_index(self, index) -> int | None:
+        """
+        Индекс слова, которому принадлежит символ текста (слова считаются разделёнными одним символом)
+        """
+        word_index = int(np.searchsorted(self._char_starts, index, side='right')) - 1
+        if word_index < 0 or index > self._char_ends[word_index]:
+            return None
+        return word_index
+
+    def write_timecode(self, start_time, end_time, start_i, end_i, source: int | None = None):
         average_index = (start_i + end_i) / 2
-        word = self.get_word_by_index(average_index)
-        if not word:
+        word_index = self.get_word_by_index(average_index)
+        if word_index is None:
             return False
 
-        word.start = min(start_time, word.start)
-        word.end = max(end_time, word.end)
+        self.timeline.starts[word_index] = min(start_time, self.timeline.starts[word_index])
+        self.timeline.ends[word_index] = max(end_time, self.timeline.ends[word_index])
+        if source is not None:
+            if self.first_sources[word_index] < 0:
+                self.first_sources[word_index] = source
+            self.last_sources[word_index] = source
 
         return True
 
 
 class TextAlignmentLinker(TimestampLinker):
-    en_vowels = "aeiouу"
-    ru_vowels = "еыаоэяию"
-    vowels = en_vowels + ru_vowels
+    en_vowels = EN_VOWELS
+    ru_vowels = RU_VOWELS
+    vowels = VOWELS
 
     ENABLE_MATCH_WORDS_LINKING = True
     ENABLE_VOWELS_LINKING = False
@@ -61,6 +79,20 @@ class TextAlignmentLinker(TimestampLinker):
         self.min_word_ratio = 0.6
 
     def link_timestamps_to_song_text(self, full_text: str, phrases: list[Phrase]) -> list[Phrase]:
+        timeline = self.align(full_text, phrases).timeline
+
+        #  Отсутствие таймкода начала или конца
+
+        timeline.interpolate_gaps(timeline.unknown_words(), head_start=phrases[0].start, tail_end=phrases[-1].end)
+        timeline.sync_phrase_bounds()
+
+        return timeline.to_phrases()
+
+    def align(self, full_text: str, phrases: list[Phrase]) -> TextStorage:
+        """
+        Выравнивание всего текста по распознанным словам. Тайминги слов, для которых
+        не нашлось пары, остаются неизвестными
+        """
         recognized = "^".join(["^".join(w.word.lower() for w in p.words) for p in phrases])
         matcher = SequenceMatcher(None, full_text.lower(), recognized, autojunk=False)
         matches = matcher.get_matching_blocks()
@@ -72,11 +104,14 @@ class TextAlignmentLinker(TimestampLinker):
         if ratio < self.min_full_text_ratio:
             raise RecognitionError
 
-        storage = TextStorage(full_text=full_text)
+        storage = TextStorage(full_text=full_text, vowels=self.vowels)
         prev_end_i = -1
 
+        source = -1
+
         for phrase in phrases:
             for word in phrase.words:
+                source += 1
                 start_i, end_i = prev_end_i + 1, prev_end_i + 1 + len(word.word)
                 prev_end_i = end_i
                 assert word.word.lower() == recognized[start_i:end_i], (word.word, recognized[start_i:end_i])
@@ -90,66 +125,29 @@ class TextAlignmentLinker(TimestampLinker):
                 for block in phrase_matches:
                     if self.normalize_word(full_text[block.a:block.a + block.size]) == self.normalize_word(word.word):
                         has_full_match = True
-                        storage.write_timecode(word.start, word.end, block.a, block.a + block.size)
+                        storage.write_timecode(word.start, word.end, block.a, block.a + block.size, source)
 
                 if has_full_match:
                     continue
 
                 block = phrase_matches[0]
-                original_word = storage.get_word_by_index((block.a * 2 + block.size) / 2)
-                word_matcher = SequenceMatcher(None, self.normalize_word(original_word.word), self.normalize_word(word.word), autojunk=False)
+                original_word_index = storage.get_word_by_index((block.a * 2 + block.size) / 2)
+                if original_word_index is None:
+                    continue
+                original_word = storage.timeline.words[original_word_index]
+                word_matcher = SequenceMatcher(None, self.normalize_word(original_word), self.normalize_word(word.word), autojunk=False)
                 if self.ENABLE_MATCH_WORDS_LINKING and word_matcher.ratio() >= self.min_word_ratio:
-                    storage.write_timecode(word.start, word.end, block.a, block.a + block.size)
+                    storage.write_timecode(word.start, word.end, block.a, block.a + block.size, source)
                     # print(original_word.word, word.word, word_matcher.ratio())
                     continue
 
                 if (self.ENABLE_VOWELS_LINKING
-                        and self.vowels_count(word.word) == self.vowels_count(original_word.word)
+                        and self.vowels_count(word.word) == self.vowels_count(original_word)
                         and self.vowels_count(word.word) >= self.MIN_VOWELS_FOR_MATCH):
-                    storage.write_timecode(word.start, word.end, block.a, block.a + block.size)
+                    storage.write_timecode(word.start, word.end, block.a, block.a + block.size, source)
                     # print(original_word.word, word.word)
 
-        #  Отсутствие таймкода начала или конца
-
-        last_matched_word = Word('', start=phrases[0].start, end=phrases[0].start)
-        unknown_words = []
-        for phrase in storage.phrases:
-            for word in phrase.words:
-                if word.end != -1:
-                    if unknown_words:
-                        words_weight = [max(self.vowels_count(word.word), 1) for word in unknown_words]
-                        start = last_matched_word.end
-                        end = word.start
-                        time_delta = end - start
-                        total_weight = sum(words_weight)
-                        var = start
-                        for unknown_word, weight in zip(unknown_words, words_weight):
-                            unknown_word.start = var
-                            var += time_delta * weight / total_weight
-                            unknown_word.end = var
-                        unknown_words.clear()
-                    last_matched_word = word
-                else:
-                    unknown_words.append(word)
-
-        if unknown_words:
-            word = Word('', start=unknown_words[-1].end, end=unknown_words[-1].end)
-            words_weight = [max(self.vowels_count(word.word), 1) for word in unknown_words]
-            start = last_matched_word.end
-            end = word.start
-            time_delta = end - start
-            total_weight = sum(words_weight)
-            var = start
-            for unknown_word, weight in zip(unknown_words, words_weight):
-                unknown_word.start = var
-                var += time_delta * weight / total_weight
-                unknown_word.end = var
-
-        for phrase in storage.phrases:
-            phrase.start = phrase.words[0].start
-            phrase.end = phrase.words[-1].end
-
-        return storage.phrases
+        return storage
 
     def vowels_count(self, word: str) -> int:
         return sum(map(lambda x: x in self.vowels, word))
@@ -160,7 +158,8 @@ class TextAlignmentLinker(TimestampLinker):
 
 
 if __name__ == '__main__':
-    from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer, from_json, save_to_json
+    from core.infrastructure.phrase_storage.json_format import from_json, save_to_json
+    from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
     from core.infrastructure.text_generation.genius import GeniusTextScrapper
 
     media_folder = Path("output/Cage_The_Elephant_Come_A_Little_Closer")
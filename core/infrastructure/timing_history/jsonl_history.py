@@ -0,0 +1,45 @@
+import json
+import logging
+import threading
+from dataclasses import asdict
+from pathlib import Path
+
+from core.application.cost_model import JobFeatures, TimingHistory, TimingSample
+from core.application.job import Stage
+
+logger = logging.getLogger(__name__)
+
+
+class JsonlTimingHistory(TimingHistory):
+    """
+    Замеры стадий в файле, по JSON-строке на замер
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, sample: TimingSample) -> None:
+        line = json.dumps({"stage": sample.stage.value, "seconds": sample.seconds, **asdict(sample.features)})
+        with self._lock, open(self.path, "a", encoding="utf8") as f:
+            f.write(line + "\n")
+
+    def load(self) -> list[TimingSample]:
+        samples = []
+        try:
+            with open(self.path, encoding="utf8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return samples
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                samples.append(TimingSample(
+                    stage=Stage(entry["stage"]),
+                    features=JobFeatures(entry.get("audio_duration"), entry.get("lyric_chars"), entry.get("word_count")),
+                    seconds=float(entry["seconds"]),
+                ))
+            except (ValueError, KeyError, TypeError):
+                # Например, строка, недописанная при аварийном завершении
+                logger.warning("Пропускаю повреждённую строку истории %s: %r", self.path, line)
+        return samples
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+
+from moviepy.config import FFMPEG_BINARY
+
+from core.application.dto import AudioPath, VideoPath
+from core.application.exceptions import RenderingError
+from core.infrastructure.checkpoint.file_checkpoint import file_fingerprint
+
+ENCODED_AUDIO_SUFFIX = ".m4a"
+
+
+def encoded_audio_path(back_track: AudioPath, bitrate: int, duration: float) -> Path:
+    """
+    Закодированная минусовка лежит рядом с исходной, в имени - ключ из содержимого, битрейта и длительности
+    """
+    key = hashlib.sha256(f"{file_fingerprint(back_track)}:{bitrate}:{duration:.3f}".encode()).hexdigest()[:16]
+    return back_track.with_name(f"{back_track.stem}.{key}{ENCODED_AUDIO_SUFFIX}")
+
+
+@dataclass
+class EncodedAudio:
+    path: Path
+    process: subprocess.Popen | None = None
+    temporary: Path | None = None
+
+    @property
+    def cached(self) -> bool:
+        return self.process is None
+
+    def wait(self) -> Path:
+        if self.process is None:
+            return self.path
+        _, stderr = self.process.communicate()
+        if self.process.returncode != 0:
+            self.temporary.unlink(missing_ok=True)
+            raise RenderingError(f"Не удалось закодировать звук: {stderr.decode(errors='replace')}")
+        os.replace(self.temporary, self.path)
+        self.process = None
+        return self.path
+
+    def cancel(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.communicate()
+        self.temporary.unlink(missing_ok=True)
+        self.process = None
+
+
+def encode_audio(back_track: AudioPath, bitrate: int, duration: float) -> EncodedAudio:
+    """
+    Запускает кодирование минусовки в AAC отдельным процессом ffmpeg и сразу возвращает управление.
+    Если такая минусовка уже закодирована, процесс не запускается
+    """
+    path = encoded_audio_path(back_track, bitrate, duration)
+    if path.exists():
+        return EncodedAudio(path)
+    temporary = path.with_name(f"{path.stem}.{os.getpid()}.tmp{ENCODED_AUDIO_SUFFIX}")
+    process = subprocess.Popen(
+        [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", str(back_track),
+            "-t", f"{duration:.3f}",
+            "-vn", "-c:a", "aac", "-b:a", f"{bitrate // 1000}k",
+            str(temporary),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    return EncodedAudio(path, process, temporary)
+
+
+def mux(video: VideoPath, audio: Path, destination: Path) -> VideoPath:
+    """
+    Склеивает видео без звука и готовую звуковую дорожку без перекодирования
+    """
+    result = subprocess.run(
+        [
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", str(video), "-i", str(audio),
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c", "copy", "-shortest",
+            "-movflags", "+faststart",
+            str(destination),
+        ],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RenderingError(f"Не удалось добавить звук в видео: {result.stderr.decode(errors='replace')}")
+    return VideoPath(destination)
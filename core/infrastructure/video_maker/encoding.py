@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+
+# Лимит на загрузку файла ботом в Telegram
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+# Запас на контейнер mp4 и неточность ограничения битрейта
+CONTAINER_OVERHEAD = 0.08
+
+# Разрешение, fps и минимальный битрейт видео, при котором разрешение ещё выглядит прилично.
+# Кадр караоке почти статичен, поэтому битрейты заметно ниже обычных
+RESOLUTION_LADDER = (
+    ((1920, 1080), 12, 900_000),
+    ((1280, 720), 12, 500_000),
+    ((854, 480), 10, 250_000),
+    ((640, 360), 8, 0),
+)
+AUDIO_BITRATES = (160_000, 128_000, 96_000, 64_000)
+# Доля общего битрейта, которую можно отдать под звук
+MAX_AUDIO_SHARE = 0.2
+# Ключевой кадр раз в GOP_SECONDS: кадр меняется мало, длинный GOP экономит место
+GOP_SECONDS = 10
+CRF = 23
+
+
+@dataclass(slots=True, frozen=True)
+class EncodingPlan:
+    output_size: tuple[int, int]
+    fps: int
+    crf: int
+    video_bitrate: int
+    audio_bitrate: int
+    gop: int
+    preset: str = "veryfast"
+
+    def ffmpeg_params(self) -> list[str]:
+        """
+        CRF с ограничением maxrate: статичные участки кодируются дёшево, а размер файла не превышает цель
+        """
+        return [
+            "-crf", str(self.crf),
+            "-maxrate", f"{self.video_bitrate // 1000}k",
+            "-bufsize", f"{2 * self.video_bitrate // 1000}k",
+            "-tune", "stillimage",
+            "-g", str(self.gop),
+            "-keyint_min", str(self.gop),
+            "-sc_threshold", "0",
+            # Без B-кадров время кадров идёт в порядке записи, и склейка отрезков (splicing.splice) их не сдвигает
+            "-bf", "0",
+            "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart",
+        ]
+
+
+def plan_encoding(
+        duration: float,
+        target_size: int = TELEGRAM_UPLOAD_LIMIT,
+        max_size: tuple[int, int] = RESOLUTION_LADDER[0][0],
+        max_fps: int = RESOLUTION_LADDER[0][1],
+) -> EncodingPlan:
+    """
+    Подбирает параметры кодирования так, чтобы ролик длительностью duration секунд
+    уложился в target_size байт за один проход
+    """
+    total_bitrate = target_size * 8 * (1 - CONTAINER_OVERHEAD) / max(duration, 1.0)
+    audio_bitrate = next(
+        (bitrate for bitrate in AUDIO_BITRATES if bitrate <= total_bitrate * MAX_AUDIO_SHARE),
+        AUDIO_BITRATES[-1],
+    )
+    video_bitrate = max(int(total_bitrate - audio_bitrate), 32_000)
+
+    allowed = [rung for rung in RESOLUTION_LADDER if rung[0][1] <= max_size[1]] or [RESOLUTION_LADDER[-1]]
+    output_size, fps, _ = next(
+        (rung for rung in allowed if rung[2] <= video_bitrate),
+        allowed[-1],
+    )
+    fps = min(fps, max_fps)
+    return EncodingPlan(
+        output_size=output_size,
+        fps=fps,
+        crf=CRF,
+        video_bitrate=video_bitrate,
+        audio_bitrate=audio_bitrate,
+        gop=fps * GOP_SECONDS,
+    )
@@ -1,4 +1,6 @@
+import hashlib
 import json
+import tempfile
 from pathlib import Path
 
 import adaptix
@@ -6,11 +8,16 @@ import numpy as np
 from moviepy import AudioFileClip, ImageClip, CompositeVideoClip, TextClip, vfx, ColorClip
 
 from core.application.dto import AudioPath, ImagePath, VideoPath
-from core.application.video_maker import VideoMaker
+from core.application.metrics import MetricsRecorder, NullMetrics
+from core.application.phrase_timeline import PhraseTimeline
+from core.application.video_maker import IncrementalVideoMaker
 from core.application.voice_recognition import Phrase
+from core.infrastructure.video_maker.audio_track import encode_audio, mux
+from core.infrastructure.video_maker.encoding import EncodingPlan, plan_encoding, TELEGRAM_UPLOAD_LIMIT
+from core.infrastructure.video_maker.splicing import can_splice, changed_ranges, splice
 
 
-class FfmpegVideoMaker(VideoMaker):
+class FfmpegVideoMaker(IncrementalVideoMaker):
     inactive_color = (255, 255, 255, 255)
     active_color = (255, 165, 0, 255)
     back_color = (0, 0, 0, 128)
@@ -18,6 +25,36 @@ class FfmpegVideoMaker(VideoMaker):
     font_size = 40
     output_size = (1920, 1080)
     fps = 12
+    output_name = "karaoke"
+    # Если изменилась большая доля видео, проще отрисовать его целиком
+    MAX_RERENDER_SHARE = 0.6
+
+    def __init__(
+            self,
+            output_size: tuple[int, int] | None = None,
+            fps: int | None = None,
+            max_duration: float | None = None,
+            output_name: str | None = None,
+            target_size: int = TELEGRAM_UPLOAD_LIMIT,
+            metrics: MetricsRecorder | None = None,
+    ):
+        if output_size is not None:
+            # Размер шрифта подобран под 1080p, при другом разрешении масштабируем его
+            self.font_size = max(round(self.font_size * output_size[1] / self.output_size[1]), 8)
+            self.output_size = output_size
+        self.fps = fps or self.fps
+        self.output_name = output_name or self.output_name
+        self.max_duration = max_duration
+        self.target_size = target_size
+        self.metrics = metrics or NullMetrics()
+
+    @classmethod
+    def preview(cls, metrics: MetricsRecorder | None = None) -> "FfmpegVideoMaker":
+        """
+        Быстрое превью: первые 30 секунд в низком разрешении
+        """
+        return cls(output_size=(640, 360), fps=8, max_duration=30.0, output_name="preview",
+                   target_size=5 * 1024 * 1024, metrics=metrics)
 
     def create_background_with_image(self, image_path, size):
         w, h = size
@@ -125,10 +162,143 @@ class FfmpegVideoMaker(VideoMaker):
             destination: Path | None = None,
     ) -> VideoPath:
 
-        # Загрузка и проверка аудио
-        audio_clip = AudioFileClip(back_track)
-        total_duration = audio_clip.duration
+        total_duration = self.video_duration(back_track)
+
+        # Разрешение и битрейт подбираются под длительность, чтобы файл пролез в лимит Telegram
+        plan = self.encoding_plan(total_duration)
+
+        # Звук кодирует ffmpeg параллельно с отрисовкой, готовая дорожка переиспользуется при перерисовке
+        encoded_audio = encode_audio(back_track, plan.audio_bitrate, total_duration)
+        self.metrics.record_cache("encoded_audio", hit=encoded_audio.cached)
+
+        output_path = destination or self.default_destination()
+        video_only_path = output_path.with_name(f"{output_path.stem}.video{output_path.suffix}")
+        try:
+            maker = self if plan.output_size == self.output_size else self.resized(plan.output_size)
+            final_clip = maker.compose_video_clip(cover_image, timestamped_phrases, total_duration)
+
+            # Экспорт
+            self.write_video(final_clip, video_only_path, plan)
+            mux(video_only_path, encoded_audio.wait(), output_path)
+        finally:
+            encoded_audio.cancel()
+            video_only_path.unlink(missing_ok=True)
+        self.metrics.record_render(self.output_name, total_duration, int(total_duration * plan.fps))
+
+        return VideoPath(output_path)
+
+    def rerender_video(
+            self,
+            song_title: str,
+            cover_image: ImagePath,
+            back_track: AudioPath,
+            previous_phrases: list[Phrase],
+            timestamped_phrases: list[Phrase],
+            previous_video: VideoPath,
+            destination: Path | None = None,
+    ) -> VideoPath:
+        total_duration = self.video_duration(back_track)
+        plan = self.encoding_plan(total_duration)
+        # Ключевые кадры стоят через каждые gop кадров, поэтому отрезки такой длины заменяются без перекодирования
+        segment_seconds = plan.gop / plan.fps
+        ranges = changed_ranges(
+            self.visible_phrases(previous_phrases, total_duration),
+            self.visible_phrases(timestamped_phrases, total_duration),
+            total_duration,
+            segment_seconds,
+        )
+        changed_duration = sum(end - start for start, end in ranges)
+        if (changed_duration > self.MAX_RERENDER_SHARE * total_duration
+                or not can_splice(previous_video, ranges, total_duration, plan.output_size, plan.fps)):
+            return self.compile_video(song_title, cover_image, back_track, timestamped_phrases, destination)
+
+        # Минусовка уже закодирована при отрисовке предыдущего видео
+        encoded_audio = encode_audio(back_track, plan.audio_bitrate, total_duration)
+        self.metrics.record_cache("encoded_audio", hit=encoded_audio.cached)
+
+        output_path = destination or self.default_destination()
+        video_only_path = output_path.with_name(f"{output_path.stem}.video{output_path.suffix}")
+        try:
+            with tempfile.TemporaryDirectory(dir=output_path.parent) as pieces_dir:
+                pieces = []
+                if ranges:
+                    maker = self if plan.output_size == self.output_size else self.resized(plan.output_size)
+                    final_clip = maker.compose_video_clip(cover_image, timestamped_phrases, total_duration)
+                    for start, end in ranges:
+                        piece = Path(pieces_dir) / f"{start:.0f}.mp4"
+                        self.write_video(final_clip.subclipped(start, end), piece, plan)
+                        pieces.append((start, end, piece))
+                splice(previous_video, pieces, total_duration, video_only_path)
+            mux(video_only_path, encoded_audio.wait(), output_path)
+        finally:
+            encoded_audio.cancel()
+            video_only_path.unlink(missing_ok=True)
+        self.metrics.record_render(self.output_name, changed_duration, int(changed_duration * plan.fps))
+
+        return VideoPath(output_path)
+
+    def default_destination(self) -> Path:
+        # Не в рабочую папку процесса: одновременные задачи не должны делить файлы
+        return Path(tempfile.mkdtemp(prefix="karaoke-")) / f"{self.output_name}.mp4"
+
+    def video_duration(self, back_track: AudioPath) -> float:
+        # Длительность берётся из минусовки, сама минусовка кодируется отдельно
+        with AudioFileClip(back_track) as audio_clip:
+            total_duration = audio_clip.duration
+        if self.max_duration is not None and total_duration > self.max_duration:
+            total_duration = self.max_duration
+        return total_duration
+
+    def write_video(self, clip, path: Path, plan: EncodingPlan):
+        clip.write_videofile(
+            filename=path,
+            fps=plan.fps,
+            codec='libx264',
+            audio=False,
+            threads=12,
+            preset=plan.preset,
+            ffmpeg_params=plan.ffmpeg_params(),
+        )
+
+    @staticmethod
+    def visible_phrases(timestamped_phrases: list[Phrase], total_duration: float) -> list[Phrase]:
+        """
+        Фразы в том виде, в каком они рисуются
+        """
+        # Каждая фраза подсвечивается с конца предыдущей
+        timeline = PhraseTimeline.from_phrases(timestamped_phrases)
+        timeline.chain_phrases()
+        # Фразы после конца ролика не отрисовываем, следующую за последней оставляем для нижней строки
+        visible_count = int(np.searchsorted(timeline.phrase_starts, total_duration)) + 1
+        return timeline.to_phrases()[:visible_count]
+
+    def settings_key(self) -> str:
+        """
+        Хеш настроек, от которых зависит, как выглядит видео
+        """
+        settings = (self.output_size, self.fps, self.max_duration, self.target_size, self.font, self.font_size,
+                    self.inactive_color, self.active_color, self.back_color)
+        return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+    def encoding_plan(self, duration: float) -> EncodingPlan:
+        return plan_encoding(duration, target_size=self.target_size, max_size=self.output_size, max_fps=self.fps)
+
+    def resized(self, output_size: tuple[int, int]) -> "FfmpegVideoMaker":
+        return type(self)(
+            output_size=output_size,
+            fps=self.fps,
+            max_duration=self.max_duration,
+            output_name=self.output_name,
+            target_size=self.target_size,
+            metrics=self.metrics,
+        )
 
+    def compose_video_clip(
+            self,
+            cover_image: ImagePath,
+            timestamped_phrases: list[Phrase],
+            total_duration: float,
+    ) -> CompositeVideoClip:
         # Загружаем фоновое изображение
         background = self.create_background_with_image(cover_image, self.output_size).with_duration(total_duration)
 
@@ -137,13 +307,12 @@ class FfmpegVideoMaker(VideoMaker):
         line_height = self.get_text_dimensions(timestamped_phrases[0].text)[1] + int(
             self.font_size * 0.5) + 10
 
-        previous_phrase = None
+        timestamped_phrases = self.visible_phrases(timestamped_phrases, total_duration)
+
         # Верхняя линия: анимированные клипы для каждой фразы
         for phrase in timestamped_phrases:
-            phrase.start = previous_phrase.end if previous_phrase is not None else 0.0
             animated_clip = self.create_phrase_animation(phrase).with_position(('center', 0))
             clips.append(animated_clip)
-            previous_phrase = phrase
 
         # Нижняя линия: статические клипы для следующих фраз
         if len(timestamped_phrases) > 1:
@@ -172,29 +341,13 @@ class FfmpegVideoMaker(VideoMaker):
         # Создаем композицию фраз
         phrase_composite = CompositeVideoClip(clips, size=(max_width, total_height)).with_duration(total_duration)
 
-        # Центрируем композицию фраз в кадре 1920x1080
+        # Центрируем композицию фраз в кадре
         pos_x = (self.output_size[0] - max_width) / 2
         pos_y = (self.output_size[1] - total_height) / 2
         phrase_composite = phrase_composite.with_position((pos_x, pos_y))
 
         # Создаем финальный клип с фоном и фразами
-        final_clip = CompositeVideoClip([background, phrase_composite], size=self.output_size)
-        final_clip = final_clip.with_audio(audio_clip)
-
-        # Экспорт
-        output_path = destination or Path(f"{song_title}_karaoke.mp4")
-        final_clip.write_videofile(
-            filename=output_path,
-            fps=self.fps,
-            codec='libx264',
-            audio_codec='aac',
-            threads=12,
-            preset='ultrafast',
-            # ffmpeg_params=['-crf', '18']
-        )
-
-        return VideoPath(output_path)
-
+        return CompositeVideoClip([background, phrase_composite], size=self.output_size)
 
 if __name__ == '__main__':
     song_title = "Cage the elephant - Come a little closer"
@@ -0,0 +1,132 @@
+import hashlib
+import math
+import subprocess
+from pathlib import Path
+
+from moviepy.config import FFMPEG_BINARY
+
+from core.application.dto import VideoPath
+from core.application.exceptions import RenderingError
+from core.application.voice_recognition import Phrase
+
+
+def segment_signatures(phrases: list[Phrase], duration: float, segment_seconds: float) -> list[str]:
+    """
+    Хеш того, что отрисовывается на каждом отрезке видео длиной segment_seconds.
+    phrases - фразы в том виде, в каком они рисуются: верхняя строка - фраза от start до end,
+    нижняя - следующая фраза, пока звучит текущая. От первой фразы зависит высота строк, поэтому она входит во все хеши
+    """
+    segments = [hashlib.sha256(phrases[0].text.encode() if phrases else b"") for _ in range(
+        math.ceil(duration / segment_seconds))]
+
+    def draw(start: float, end: float, *parts):
+        first = max(int(start // segment_seconds), 0)
+        last = min(int(end // segment_seconds), len(segments) - 1)
+        for segment in segments[first:last + 1]:
+            segment.update(repr(parts).encode())
+
+    for i, phrase in enumerate(phrases):
+        words = [(word.word, word.start, word.end) for word in phrase.words]
+        draw(phrase.start, phrase.end, "top", phrase.text, phrase.start, phrase.end, words)
+        if i > 0:
+            shown_from = phrases[i - 1].start if i > 1 else 0.0
+            draw(shown_from, phrase.start, "bottom", phrase.text, shown_from, phrase.start)
+    return [segment.hexdigest() for segment in segments]
+
+
+def changed_ranges(previous: list[Phrase], current: list[Phrase], duration: float,
+                   segment_seconds: float) -> list[tuple[float, float]]:
+    """
+    Отрезки видео, на которых отрисовка изменилась. Соседние отрезки объединяются
+    """
+    ranges = []
+    changed = [
+        old != new
+        for old, new in zip(segment_signatures(previous, duration, segment_seconds),
+                            segment_signatures(current, duration, segment_seconds))
+    ]
+    for segment, is_changed in enumerate(changed):
+        if not is_changed:
+            continue
+        start = segment * segment_seconds
+        end = min(start + segment_seconds, duration)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def can_splice(previous_video: VideoPath, ranges: list[tuple[float, float]], duration: float,
+               output_size: tuple[int, int], fps: int) -> bool:
+    """
+    Можно ли заменить отрезки ranges в previous_video склейкой: видеоряд - H.264 того же размера и частоты кадров,
+    без переставленных кадров (B-кадров), не короче duration, и на границах отрезков стоят ключевые кадры.
+    Видео, отрисованные со старыми настройками кодирования, так не склеить - их нужно отрисовать целиком
+    """
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-v", "error", "-i", str(previous_video), "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return False
+    header = {}
+    keyframes = set()
+    frame_end = 0
+    time_base = None
+    for line in result.stdout.splitlines():
+        if line.startswith("#"):
+            name, _, value = line[1:].partition(":")
+            header[name.strip()] = value.strip()
+            continue
+        # Пакет: поток, dts, pts, длительность, размер, хеш и флаги, если пакет не ключевой
+        fields = [field.strip() for field in line.split(",")]
+        dts, pts, packet_duration = int(fields[1]), int(fields[2]), int(fields[3])
+        if time_base is None:
+            numerator, _, denominator = header.get("tb 0", "0/1").partition("/")
+            time_base = int(numerator) / int(denominator)
+        if dts != pts or abs(packet_duration * time_base * fps - 1) > 0.01:
+            return False
+        if len(fields) < 7:
+            keyframes.add(round(pts * time_base * fps))
+        frame_end = max(frame_end, pts + packet_duration)
+    if header.get("codec_id 0") != "h264" or header.get("dimensions 0") != f"{output_size[0]}x{output_size[1]}":
+        return False
+    if time_base is None or frame_end * time_base < duration - 1 / fps:
+        return False
+    boundaries = {boundary for start, end in ranges for boundary in (start, end) if boundary < duration}
+    return all(round(boundary * fps) in keyframes for boundary in boundaries)
+
+
+def splice(previous_video: VideoPath, pieces: list[tuple[float, float, Path]], duration: float,
+           destination: Path) -> VideoPath:
+    """
+    Заменяет в видеоряде previous_video отрезки [start, end) на заново отрисованные без перекодирования.
+    Границы отрезков должны совпадать с ключевыми кадрами - для этого видео кодируется с постоянным GOP.
+    Звук отбрасывается
+    """
+    lines = ["ffconcat version 1.0"]
+    position = 0.0
+    for start, end, piece in [*pieces, (duration, duration, None)]:
+        if start > position:
+            lines += [f"file '{previous_video.resolve()}'", f"inpoint {position:.3f}", f"outpoint {start:.3f}"]
+        if piece is not None:
+            lines.append(f"file '{piece.resolve()}'")
+        position = end
+    playlist = destination.with_suffix(".ffconcat")
+    playlist.write_text("\n".join(lines) + "\n", encoding="utf8")
+    try:
+        result = subprocess.run(
+            [
+                FFMPEG_BINARY, "-y", "-v", "error",
+                "-f", "concat", "-safe", "0", "-i", str(playlist),
+                "-map", "0:v:0", "-an", "-c", "copy",
+                str(destination),
+            ],
+            capture_output=True,
+        )
+    finally:
+        playlist.unlink(missing_ok=True)
+    if result.returncode != 0:
+        raise RenderingError(f"Не удалось склеить видео: {result.stderr.decode(errors='replace')}")
+    return VideoPath(destination)
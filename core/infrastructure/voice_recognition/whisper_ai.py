@@ -1,10 +1,9 @@
-import dataclasses
-import json
 from dataclasses import dataclass
 from pathlib import Path
 
 from core.application.voice_recognition import VoiceRecognizer, Phrase
 from core.application.dto import AudioPath
+from core.infrastructure.phrase_storage.json_format import from_json, save_to_json
 
 import whisper
 from adaptix import Retort
@@ -34,10 +33,17 @@ class WhisperRecognizer(VoiceRecognizer):
     def __init__(self):
         self.retort = Retort(strict_coercion=False)
         self.model_name = "large"
+        self._model = None
+
+    @property
+    def model(self):
+        # Модель загружается один раз на экземпляр, при первом распознавании
+        if self._model is None:
+            self._model = whisper.load_model(self.model_name)
+        return self._model
 
     def get_text_from_vocals(self, vocals: AudioPath) -> list[Phrase]:
-        model = whisper.load_model(self.model_name)
-        result = model.transcribe(str(vocals), word_timestamps=True, fp16=False)
+        result = self.model.transcribe(str(vocals), word_timestamps=True, fp16=False)
 
         whisper_response = self.retort.load(result, WhisperResponse)
 
@@ -54,23 +60,6 @@ class WhisperRecognizer(VoiceRecognizer):
         return result
 
 
-class EnhancedJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        return super().default(o)
-
-
-def save_to_json(phrases: list[Phrase], filename: str | Path):
-    with open(filename, 'w') as f:
-        json.dump(phrases, f, cls=EnhancedJSONEncoder)
-
-
-def from_json(filename: str) -> list[Phrase]:
-    with open(filename, 'r') as f:
-        return Retort(strict_coercion=False).load(json.load(f), list[Phrase])
-
-
 if __name__ == "__main__":
     song_title = "Cage the elephant - Come a little closer"
     media_folder = Path(f"media/{song_title}/audio.mp3")
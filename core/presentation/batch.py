@@ -0,0 +1,237 @@
+"""
+Пакетное создание караоке для каталога песен.
+
+    uv run python -m core.presentation.batch SONGS [--output batch_output] [--cpu-workers 2] [--memory-budget-mb 8192]
+
+SONGS - папка, в которой каждая подпапка описывает песню: аудио (audio.* или любой аудиофайл), обложка cover.*,
+необязательный текст original_text.txt; название песни - имя подпапки.
+Либо манифест .jsonl, по строке на песню: {"audio": ..., "title": ..., "cover": ..., "lyrics": ...},
+пути относительно манифеста, lyrics необязателен.
+
+Модели загружаются один раз на весь запуск. Стадии выполняются планировщиком в пулах своих ресурсов,
+поэтому, пока одна песня распознаётся, следующая уже разделяется, а предыдущая отрисовывается.
+Прерванный запуск продолжается с последних завершённых стадий
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from core.application.cost_model import CostModel
+from core.application.job import Job, Stage, StageListener
+from core.application.scheduler import DEFAULT_WORKERS, Resource, StageScheduler
+from core.application.separation import SeparationResult
+from core.application.video_director import VideoDirector
+from core.infrastructure.checkpoint.file_checkpoint import FileJobCheckpoint
+from core.infrastructure.media.ffprobe import probe_duration
+from core.infrastructure.metrics.prometheus import PrometheusMetrics
+from core.infrastructure.separation.spleeter_ai import SpleeterSeparator
+from core.infrastructure.text_generation.genius import GeniusTextScrapper
+from core.infrastructure.text_generation.local import LocalTextScrapper
+from core.infrastructure.timing_history.jsonl_history import JsonlTimingHistory
+from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
+from core.infrastructure.video_maker.ffmpeg_video_maker import FfmpegVideoMaker
+from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
+
+OUTPUT_FOLDER = Path("batch_output")
+AUDIO_SUFFIXES = {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aac", ".opus"}
+LYRICS_NAME = "original_text.txt"
+TIMING_HISTORY_NAME = "stage_timings.jsonl"
+
+
+@dataclass(slots=True)
+class Song:
+    title: str
+    audio: Path
+    cover: Path
+    lyrics: Path | None = None
+
+
+@dataclass(slots=True)
+class SongReport:
+    title: str
+    stage_times: dict[Stage, float] = field(default_factory=dict)
+    submitted_at: float = 0.0
+    finished_at: float = 0.0
+    audio_duration: float | None = None
+    video: Path | None = None
+    error: str | None = None
+
+
+def find_songs(folder: Path) -> list[Song]:
+    songs = []
+    for song_folder in sorted(path for path in folder.iterdir() if path.is_dir()):
+        audio = next(song_folder.glob("audio.*"), None) or next(
+            (path for path in sorted(song_folder.iterdir()) if path.suffix.lower() in AUDIO_SUFFIXES), None
+        )
+        cover = next(song_folder.glob("cover.*"), None)
+        if audio is None or cover is None:
+            logging.warning("Пропускаю %s: нет аудио или обложки", song_folder)
+            continue
+        lyrics = song_folder / LYRICS_NAME
+        songs.append(Song(song_folder.name, audio, cover, lyrics if lyrics.exists() else None))
+    return songs
+
+
+def read_manifest(manifest: Path) -> list[Song]:
+    songs = []
+    with open(manifest, encoding="utf8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            songs.append(Song(
+                title=entry["title"],
+                audio=manifest.parent / entry["audio"],
+                cover=manifest.parent / entry["cover"],
+                lyrics=manifest.parent / entry["lyrics"] if entry.get("lyrics") else None,
+            ))
+    return songs
+
+
+def wav_duration(path: Path) -> float | None:
+    try:
+        with wave.open(str(path)) as f:
+            return f.getnframes() / f.getframerate()
+    except (OSError, wave.Error):
+        return None
+
+
+class StageTimesListener(StageListener):
+    def __init__(self, report: SongReport):
+        self._report = report
+        self._started: dict[Stage, float] = {}
+
+    def on_stage_started(self, stage: Stage) -> None:
+        self._started[stage] = time.perf_counter()
+
+    def on_stage_finished(self, stage: Stage, result: Any) -> None:
+        self._report.stage_times[stage] = time.perf_counter() - self._started.pop(stage)
+        if isinstance(result, SeparationResult):
+            self._report.audio_duration = wav_duration(result.back_track)
+
+
+def run_batch(songs: list[Song], output: Path, cpu_workers: int, memory_budget: int | None) -> list[SongReport]:
+    metrics = PrometheusMetrics()
+    output.mkdir(parents=True, exist_ok=True)
+    # Короткие песни не ждут длинных, история замеров пополняется с каждым запуском
+    cost_model = CostModel(JsonlTimingHistory(output / TIMING_HISTORY_NAME))
+    director = VideoDirector(
+        audio_separator=SpleeterSeparator(),
+        text_generator=LocalTextScrapper(
+            {song.title: song.lyrics for song in songs if song.lyrics is not None}, GeniusTextScrapper()
+        ),
+        voice_recognizer=WhisperRecognizer(),
+        timestamp_linker=WordGrabberTextAlignmentLinker(),
+        video_maker=FfmpegVideoMaker(metrics=metrics),
+        metrics=metrics,
+        cost_model=cost_model,
+    )
+    scheduler = StageScheduler(
+        director,
+        workers={**DEFAULT_WORKERS, Resource.CPU: cpu_workers},
+        memory_budget=memory_budget,
+        metrics=metrics,
+        cost_model=cost_model,
+    )
+    reports = []
+    futures = []
+    for song in songs:
+        report = SongReport(song.title, submitted_at=time.perf_counter())
+        checkpoint = FileJobCheckpoint(output / song.title, audio=song.audio, song_title=song.title,
+                                       cover_image=song.cover)
+        separation = checkpoint.load(Stage.SEPARATION)
+        if separation is not None:
+            report.audio_duration = wav_duration(separation.back_track)
+        job = Job(audio=song.audio, song_title=song.title, cover_image=song.cover,
+                  checkpoint=checkpoint, listener=StageTimesListener(report),
+                  audio_duration=probe_duration(song.audio), work_dir=checkpoint.job_dir)
+        future = scheduler.submit(job)
+        future.add_done_callback(lambda _, report=report: setattr(report, "finished_at", time.perf_counter()))
+        reports.append(report)
+        futures.append((checkpoint, future))
+
+    for report, (checkpoint, future) in zip(reports, futures):
+        try:
+            report.video = future.result()
+            checkpoint.mark_finished()
+        except Exception as e:
+            logging.exception("Не удалось создать караоке для %r", report.title)
+            report.error = repr(e)
+        print(format_song(report), file=sys.stderr)
+    scheduler.shutdown()
+    return reports
+
+
+def format_song(report: SongReport) -> str:
+    if report.error is not None:
+        return f"✗ {report.title}: {report.error}"
+    stages = ", ".join(f"{stage.value} {seconds:.1f}s" for stage, seconds in report.stage_times.items())
+    line = f"✓ {report.title}: {report.finished_at - report.submitted_at:.1f}s ({stages or 'из кеша'})"
+    if report.audio_duration:
+        line += f", {report.audio_duration:.0f}s аудио"
+    return line
+
+
+def summarize(reports: list[SongReport], wall_time: float) -> dict:
+    finished = [report for report in reports if report.error is None]
+    audio_seconds = sum(report.audio_duration or 0.0 for report in finished)
+    stage_totals: dict[str, float] = {}
+    for report in finished:
+        for stage, seconds in report.stage_times.items():
+            stage_totals[stage.value] = stage_totals.get(stage.value, 0.0) + seconds
+    return {
+        "songs": len(reports),
+        "finished": len(finished),
+        "failed": len(reports) - len(finished),
+        "wall_seconds": wall_time,
+        "songs_per_hour": len(finished) / wall_time * 3600 if wall_time > 0 else 0.0,
+        # Сколько секунд аудио обрабатывается за секунду работы
+        "realtime_factor": audio_seconds / wall_time if wall_time > 0 else 0.0,
+        "stage_seconds": stage_totals,
+        "per_song": [
+            {
+                "title": report.title,
+                "seconds": report.finished_at - report.submitted_at,
+                "audio_seconds": report.audio_duration,
+                "stages": {stage.value: seconds for stage, seconds in report.stage_times.items()},
+                "video": str(report.video) if report.video is not None else None,
+                "error": report.error,
+            }
+            for report in reports
+        ],
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("songs", type=Path, help="Папка с песнями или манифест .jsonl")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FOLDER)
+    parser.add_argument("--cpu-workers", type=int, default=DEFAULT_WORKERS[Resource.CPU],
+                        help="Сколько стадий разметки и отрисовки выполнять одновременно")
+    parser.add_argument("--memory-budget-mb", type=int, help="Ограничение памяти одновременно выполняемых стадий")
+    parser.add_argument("--report", type=Path, help="Куда дополнительно сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    songs = find_songs(args.songs) if args.songs.is_dir() else read_manifest(args.songs)
+    if not songs:
+        parser.error(f"В {args.songs} не найдено ни одной песни")
+    start = time.perf_counter()
+    memory_budget = args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None
+    reports = run_batch(songs, args.output, args.cpu_workers, memory_budget)
+    summary = summarize(reports, time.perf_counter() - start)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.report is not None:
+        args.report.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf8")
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Замеры производительности и качества на песнях из media.
+
+    uv run python -m core.presentation.benchmark [--skip-render] [--threshold 0.2]
+
+Результаты дописываются одной JSON-строкой в историю (по умолчанию benchmark_history.jsonl).
+Если какой-то замер стал хуже предыдущего запуска больше чем на threshold, команда завершается с кодом 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from core.application.voice_recognition import Phrase
+from core.infrastructure.phrase_storage.binary_format import from_binary, save_to_binary
+from core.infrastructure.phrase_storage.json_format import from_json, save_to_json
+from core.infrastructure.timestamp_linking.hybrid_alignment_linking import HybridAlignmentLinker
+from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
+from core.infrastructure.timestamp_linking.text_alignment_linking import TextAlignmentLinker
+
+MEDIA_FOLDER = Path("media")
+HISTORY_FILE = Path("benchmark_history.jsonl")
+# Строка считается найденной, если её начало отличается от эталона не больше чем на столько секунд
+FOUND_TOLERANCE = 0.5
+LINKERS = {
+    "text_alignment": TextAlignmentLinker,
+    "word_grabber": WordGrabberTextAlignmentLinker,
+    "hybrid": HybridAlignmentLinker,
+}
+
+
+def best_time(function: Callable[[], object], repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def linking_quality(phrases: list[Phrase], reference: list[Phrase]) -> dict:
+    """
+    Сравнение с эталонной разметкой linking.json по строкам с совпадающим текстом.
+    Строки, у которых в эталоне нет таймингов, не учитываются
+    """
+    comparable = [
+        (phrase, expected)
+        for phrase, expected in zip(phrases, reference)
+        if phrase.text == expected.text and math.isfinite(expected.start)
+    ]
+    drifts = [abs(phrase.start - expected.start) for phrase, expected in comparable]
+    word_drifts = [
+        abs(word.start - expected_word.start)
+        for phrase, expected in comparable
+        for word, expected_word in zip(phrase.words, expected.words)
+        if math.isfinite(expected_word.start)
+    ]
+    found = sum(drift <= FOUND_TOLERANCE for drift in drifts)
+    return {
+        "found_lines": found,
+        "missing_lines": len(comparable) - found,
+        "mean_drift": float(np.mean(drifts)) if drifts else math.nan,
+        "p95_drift": float(np.percentile(drifts, 95)) if drifts else math.nan,
+        "mean_word_drift": float(np.mean(word_drifts)) if word_drifts else math.nan,
+    }
+
+
+def benchmark_linking(song_folder: Path, repeats: int) -> dict:
+    song_text = (song_folder / "original_text.txt").read_text(encoding="utf8")
+    reference = from_json(song_folder / "linking.json")
+    results = {}
+    for name, linker_class in LINKERS.items():
+        phrases = []
+
+        def link():
+            # Линкеры подробно печатают ход сопоставления, в замерах это только мешает
+            with contextlib.redirect_stdout(io.StringIO()):
+                phrases[:] = linker_class().link_timestamps_to_song_text(song_text, from_json(song_folder / "transcribe.json"))
+
+        results[name] = {"seconds": best_time(link, repeats), **linking_quality(phrases, reference)}
+    return results
+
+
+def benchmark_serialization(song_folder: Path, work_folder: Path, repeats: int) -> dict:
+    phrases = from_json(song_folder / "transcribe.json")
+    json_file = work_folder / "transcribe.json"
+    binary_file = work_folder / "transcribe.phrases"
+    save_to_json(phrases, json_file)
+    save_to_binary(phrases, binary_file)
+    return {
+        "json_save_seconds": best_time(lambda: save_to_json(phrases, json_file), repeats),
+        "json_load_seconds": best_time(lambda: from_json(json_file), repeats),
+        "binary_save_seconds": best_time(lambda: save_to_binary(phrases, binary_file), repeats),
+        "binary_load_seconds": best_time(lambda: from_binary(binary_file), repeats),
+    }
+
+
+def write_synthetic_back_track(path: Path, duration: float, sample_rate: int = 44100):
+    """
+    Тихий аккорд вместо настоящей минусовки: у замера не должно быть зависимости от разделения
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    signal = sum(np.sin(2 * np.pi * frequency * t) for frequency in (220.0, 277.18, 329.63)) * 0.1
+    samples = (np.repeat(signal[:, None], 2, axis=1) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+
+
+def benchmark_render(song_folder: Path, work_folder: Path, clip_seconds: float) -> dict:
+    from core.infrastructure.video_maker.ffmpeg_video_maker import FfmpegVideoMaker
+
+    back_track = work_folder / "back_track.wav"
+    write_synthetic_back_track(back_track, clip_seconds)
+    video_maker = FfmpegVideoMaker(max_duration=clip_seconds, output_name="benchmark")
+    destination = work_folder / "benchmark.mp4"
+    start = time.perf_counter()
+    video_maker.compile_video(
+        song_title=song_folder.name,
+        cover_image=next(song_folder.glob("cover.*")),
+        back_track=back_track,
+        timestamped_phrases=from_json(song_folder / "linking.json"),
+        destination=destination,
+    )
+    return {
+        "seconds": time.perf_counter() - start,
+        "clip_seconds": clip_seconds,
+        "bytes": destination.stat().st_size,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}/"))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def find_regressions(previous: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Время и дрейф - чем меньше, тем лучше; найденные строки - чем больше, тем лучше
+    """
+    regressions = []
+    previous_flat = flatten(previous)
+    for name, value in flatten(current).items():
+        old = previous_flat.get(name)
+        if old is None or math.isnan(old) or math.isnan(value):
+            continue
+        if name.endswith("seconds") or "drift" in name:
+            # Мелкие значения сильно шумят, сравниваем только заметные
+            if value > old * (1 + threshold) and value - old > 0.005:
+                regressions.append(f"{name}: {old:.4f} -> {value:.4f}")
+        elif name.endswith("found_lines") and value < old:
+            regressions.append(f"{name}: {old} -> {value}")
+    return regressions
+
+
+def last_record(history: Path) -> dict | None:
+    """
+    Последний целый запуск из истории. Оборванные (например, прерванной записью) и чужие строки пропускаются
+    """
+    if not history.exists():
+        return None
+    for line in reversed(history.read_text(encoding="utf8").splitlines()):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and isinstance(record.get("results"), dict):
+            return record
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--media", type=Path, default=MEDIA_FOLDER)
+    parser.add_argument("--history", type=Path, default=HISTORY_FILE)
+    parser.add_argument("--linking-repeats", type=int, default=1)
+    parser.add_argument("--serialization-repeats", type=int, default=20)
+    parser.add_argument("--clip-seconds", type=float, default=10.0)
+    parser.add_argument("--skip-render", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимое относительное ухудшение")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_folder:
+        for song_folder in sorted(path for path in args.media.iterdir() if path.is_dir()):
+            print(f"{song_folder.name}...", file=sys.stderr)
+            results[song_folder.name] = {
+                "linking": benchmark_linking(song_folder, args.linking_repeats),
+                "serialization": benchmark_serialization(song_folder, Path(work_folder), args.serialization_repeats),
+            }
+            if not args.skip_render:
+                results[song_folder.name]["render"] = benchmark_render(song_folder, Path(work_folder), args.clip_seconds)
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "results": results,
+    }
+    previous = last_record(args.history)
+    with open(args.history, "a", encoding="utf8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(json.dumps(record, ensure_ascii=False, indent=2))
+
+    if previous is not None:
+        regressions = find_regressions(previous["results"], results, args.threshold)
+        if regressions:
+            print("Ухудшения относительно предыдущего запуска:", *regressions, sep="\n", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
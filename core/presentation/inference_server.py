@@ -0,0 +1,127 @@
+"""
+Сервер моделей: один процесс держит Spleeter и Whisper, исполнители и бот на той же машине обращаются к нему
+через Unix-сокет вместо загрузки своих копий моделей.
+
+    uv run python -m core.presentation.inference_server SOCKET [--max-batch-size 4] [--max-wait-ms 50]
+
+Одновременные запросы собираются в пачки: разделение прогоняет пачку файлов через модель за один проход,
+распознавание выполняется по очереди на одной модели. Клиенты - RemoteSeparator и RemoteRecognizer
+"""
+import argparse
+import logging
+import socketserver
+from pathlib import Path
+
+from core.application.batching import DynamicBatcher
+from core.application.separation import SeparationResult
+from core.application.voice_recognition import Phrase
+from core.infrastructure.inference.protocol import receive_message, send_message
+from core.infrastructure.metrics.prometheus import PrometheusMetrics
+from core.infrastructure.phrase_storage.json_format import to_json_data
+from core.infrastructure.separation.spleeter_ai import SpleeterSeparator
+from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+            self,
+            socket_path: Path,
+            separator: SpleeterSeparator,
+            recognizer: WhisperRecognizer,
+            max_batch_size: int = 4,
+            max_wait: float = 0.05,
+            metrics: PrometheusMetrics | None = None,
+    ):
+        socket_path.unlink(missing_ok=True)
+        super().__init__(str(socket_path), InferenceHandler)
+        self.separator = separator
+        self.recognizer = recognizer
+        self.batchers = {
+            "separate": DynamicBatcher("inference:separate", self.separate_batch, max_batch_size, max_wait, metrics),
+            "recognize": DynamicBatcher("inference:recognize", self.recognize_batch, max_batch_size, max_wait,
+                                        metrics),
+        }
+
+    def separate_batch(self, requests: list[dict]) -> list[dict | Exception]:
+        files = [(Path(request["audio_file"]), Path(request["destination_folder"])) for request in requests]
+        try:
+            # Ошибки отдельных файлов separate_many возвращает вместо их результатов, остальные файлы
+            # пачки разделяются как обычно
+            results: list[SeparationResult | Exception] = self.separator.separate_many(files)
+        except Exception as e:
+            # Пачка не разделилась целиком (например, не загрузилась модель) - по одному файлу будет то же самое
+            logger.exception("Не удалось разделить пачку из %d файлов", len(files))
+            results = [e] * len(files)
+        responses = []
+        for (audio_file, _), result in zip(files, results):
+            if isinstance(result, Exception):
+                logger.error("Не удалось разделить %s: %r", audio_file, result)
+                responses.append(result)
+            else:
+                responses.append({"vocals": str(result.vocals), "back_track": str(result.back_track)})
+        return responses
+
+    def recognize_batch(self, requests: list[dict]) -> list[dict | Exception]:
+        # Whisper распознаёт файлы разной длины по одному, но все запросы обслуживает одна копия модели
+        responses = []
+        for request in requests:
+            try:
+                phrases: list[Phrase] = self.recognizer.get_text_from_vocals(Path(request["vocals"]))
+                responses.append({"phrases": to_json_data(phrases)})
+            except Exception as e:
+                logger.exception("Не удалось распознать %s", request["vocals"])
+                responses.append(e)
+        return responses
+
+    def server_close(self):
+        super().server_close()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    server: InferenceServer
+
+    def handle(self):
+        while (request := receive_message(self.request)) is not None:
+            batcher = self.server.batchers.get(request.get("method"))
+            if batcher is None:
+                send_message(self.request, {"error": f"Неизвестный метод {request.get('method')!r}"})
+                continue
+            try:
+                response = batcher.submit(request).result()
+            except Exception as e:
+                response = {"error": repr(e)}
+            send_message(self.request, response)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("socket", type=Path)
+    parser.add_argument("--max-batch-size", type=int, default=4)
+    parser.add_argument("--max-wait-ms", type=float, default=50.0,
+                        help="Сколько первый запрос пачки ждёт попутчиков")
+    parser.add_argument("--metrics-port", type=int)
+    args = parser.parse_args()
+
+    metrics = PrometheusMetrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    server = InferenceServer(args.socket, SpleeterSeparator(), WhisperRecognizer(), args.max_batch_size,
+                             args.max_wait_ms / 1000, metrics)
+    logger.info("Сервер моделей слушает %s", args.socket)
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    args.socket.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 import asyncio
+import concurrent.futures
+import hashlib
 import logging
 import os
-import shutil
+import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable
 
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.filters.command import Command
 from aiogram.filters.state import State, StatesGroup, StateFilter
 from aiogram.fsm.context import FSMContext
@@ -13,9 +18,26 @@ from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
 
+from core.application.broker import JobInputs, TaskState
+from core.application.cost_model import CostModel
+from core.application.dto import VideoPath
+from core.application.exceptions import RenderingError, SerializationError
+from core.application.job import Job, Stage, STAGE_DEPENDENCIES, StageListener
+from core.application.scheduler import StageScheduler
+from core.application.single_flight import Flight, SingleFlight
+from core.application.video_director import VideoDirector
+from core.infrastructure.broker.sqlite_broker import SqliteBroker
+from core.infrastructure.checkpoint.file_checkpoint import FileJobCheckpoint
+from core.infrastructure.delivery.json_file_id_index import JsonFileIdIndex
+from core.infrastructure.inference.remote import RemoteRecognizer, RemoteSeparator
+from core.infrastructure.media.ffprobe import probe_duration
+from core.infrastructure.metrics.prometheus import PrometheusMetrics
+from core.infrastructure.profiling.python_profiler import PythonStageProfiler
 from core.infrastructure.separation.spleeter_ai import SpleeterSeparator
 from core.infrastructure.text_generation.genius import GeniusTextScrapper
 from core.infrastructure.text_generation.mock import MockTextScrapper
+from core.infrastructure.timing_history.jsonl_history import JsonlTimingHistory
+from core.infrastructure.timestamp_linking.incremental_linking import IncrementalAlignmentLinker
 from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
 from core.infrastructure.video_maker.ffmpeg_video_maker import FfmpegVideoMaker
 from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
@@ -23,10 +45,74 @@ from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
 logging.basicConfig(level=logging.INFO)
 load_dotenv()
 API_KEY = os.getenv("BOT_API_KEY")
+METRICS_PORT = os.getenv("METRICS_PORT")
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
+MEMORY_BUDGET_MB = os.getenv("MEMORY_BUDGET_MB")
+BROKER_DIR = os.getenv("BROKER_DIR")
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")
+# Удалять ли отправленное видео из чекпоинта. Без него исправление текста перерисовывает всё видео
+EVICT_DELIVERED_VIDEOS = os.getenv("EVICT_DELIVERED_VIDEOS") == "1"
+# Как часто проверять ход задач, выполняемых исполнителями брокера, секунды
+BROKER_POLL_SECONDS = 2.0
+# Сколько ждать задачу, отданную брокеру: с запасом от оценки времени выполнения, но не меньше минимума.
+# Без оценки ждать минимум, чтобы задача не висела вечно, если исполнители не работают
+BROKER_TIMEOUT_FACTOR = 4
+BROKER_MIN_TIMEOUT_SECONDS = 2 * 60 * 60
+# Сколько раз задача запускается с одними входными данными, считая возобновления после перезапуска бота
+MAX_JOB_ATTEMPTS = 3
+BUSY_TEXT = "Дождитесь окончания создания караоке"
 bot = Bot(token=API_KEY)
 dp = Dispatcher()
 dp["started_at"] = datetime.now().strftime("%Y-%m-%d %H:%M")
 USER_DATA = Path("user_data")
+# file_id отправленных видео по ключу отрисовки
+DELIVERED_VIDEOS = USER_DATA / "delivered_videos.json"
+# Время выполнения стадий, по нему оценивается время ожидания
+TIMING_HISTORY = Path("stage_timings.jsonl")
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks: set[asyncio.Task] = set()
+metrics = PrometheusMetrics()
+cost_model = CostModel(JsonlTimingHistory(TIMING_HISTORY))
+delivered_videos = JsonFileIdIndex(DELIVERED_VIDEOS)
+# Чаты, для которых сейчас создаётся видео или загружаются файлы. Файлы такого чата менять нельзя
+active_jobs: set[int] = set()
+# Выполняющиеся задачи по ключу отрисовки, результат - чекпоинт задачи, которая создала видео
+video_jobs: SingleFlight[int, FileJobCheckpoint] = SingleFlight()
+# Модели загружаются один раз и переиспользуются всеми задачами
+video_maker = FfmpegVideoMaker(metrics=metrics)
+video_director = VideoDirector(
+    audio_separator=RemoteSeparator(Path(INFERENCE_SOCKET)) if INFERENCE_SOCKET else SpleeterSeparator(),
+    text_generator=GeniusTextScrapper(),
+    voice_recognizer=RemoteRecognizer(Path(INFERENCE_SOCKET)) if INFERENCE_SOCKET else WhisperRecognizer(),
+    timestamp_linker=WordGrabberTextAlignmentLinker(),
+    video_maker=video_maker,
+    preview_maker=FfmpegVideoMaker.preview(metrics=metrics),
+    metrics=metrics,
+    profiler=PythonStageProfiler(),
+    cost_model=cost_model,
+    # Исправление текста переразмечает только изменённые строки и перерисовывает только затронутые участки
+    lyrics_linker=IncrementalAlignmentLinker(),
+    video_editor=video_maker,
+)
+scheduler = StageScheduler(
+    video_director,
+    memory_budget=int(MEMORY_BUDGET_MB) * 1024 * 1024 if MEMORY_BUDGET_MB else None,
+    metrics=metrics,
+    cost_model=cost_model,
+)
+# С брокером стадии выполняют исполнители на других машинах (core.presentation.worker), модели здесь не загружаются
+broker = SqliteBroker(Path(BROKER_DIR)) if BROKER_DIR else None
+
+
+def parse_stages(value: str) -> frozenset[Stage]:
+    if value.strip() == "all":
+        return frozenset(Stage)
+    return frozenset(Stage(name.strip()) for name in value.split(",") if name.strip())
+
+
+# Стадии, которые профилируются во всех задачах, и запросы админов на профилирование следующей задачи
+PROFILE_STAGES = parse_stages(os.getenv("PROFILE_STAGES", ""))
+profile_requests: dict[int, frozenset[Stage]] = {}
 
 
 class SongStates(StatesGroup):
@@ -34,6 +120,7 @@ class SongStates(StatesGroup):
     name = State()
     audio = State()
     cover = State()
+    lyrics = State()
 
 
 @dp.message(Command("start"))
@@ -66,15 +153,33 @@ async def cmd_info(callback: types.CallbackQuery, state: FSMContext):
 @dp.message(Command("video"))
 @dp.callback_query(F.data == "video")
 async def cmd_video(callback: types.CallbackQuery):
-    video_path = "Фазенда - Мужики_karaoke.mp4"
-    video_file = FSInputFile(path=video_path)
+    if callback.from_user.id in active_jobs:
+        await bot.send_message(chat_id=callback.from_user.id, text=BUSY_TEXT)
+        return
+    checkpoint = await asyncio.to_thread(FileJobCheckpoint.open, USER_DATA / str(callback.from_user.id))
+    if checkpoint is None or not await send_delivered(callback.from_user.id, render_key(checkpoint)):
+        await bot.send_message(chat_id=callback.from_user.id, text="Готового видео пока нет")
+
 
-    await bot.send_video(chat_id=callback.from_user.id, video=video_file)
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    _, _, stages = (message.text or "").partition(" ")
+    try:
+        profile_requests[message.from_user.id] = parse_stages(stages or "all")
+    except ValueError:
+        await message.reply(f"Доступные стадии: {', '.join(stage.value for stage in Stage)}")
+        return
+    await message.reply("Следующая задача будет профилироваться")
 
 
 @dp.message(Command("song"))
 @dp.callback_query(F.data == "song")
 async def cmd_song(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id in active_jobs:
+        await bot.send_message(chat_id=callback.from_user.id, text=BUSY_TEXT)
+        return
     await state.set_state(SongStates.name)
     await bot.send_message(
         chat_id=callback.from_user.id, text=f"Введите исполнителя и название песни \n"
@@ -108,12 +213,20 @@ async def attach_audio(message: types.Message, state: FSMContext):
     audio_file_id = message.audio.file_id
     logging.info("Получен audio file ID: %r", audio_file_id)
 
-    audio_file = await bot.get_file(audio_file_id)
-    file_extension = audio_file.file_path.rsplit(".", 1)[-1]
-    destination = USER_DATA / str(message.from_user.id) / f"audio.{file_extension}"
-    shutil.rmtree(str(destination.parent), ignore_errors=True)
-    destination.parent.mkdir()
-    await bot.download_file(audio_file.file_path, destination)
+    # Аудио выполняющейся задачи заменять нельзя
+    if not claim_chat(message.from_user.id):
+        await bot.send_message(chat_id=message.from_user.id, text=BUSY_TEXT)
+        return
+    try:
+        audio_file = await bot.get_file(audio_file_id)
+        file_extension = audio_file.file_path.rsplit(".", 1)[-1]
+        destination = USER_DATA / str(message.from_user.id) / f"audio.{file_extension}"
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # Результаты прошлых стадий не удаляем: чекпоинт сам поймёт, что аудио сменилось
+        remove_files(destination.parent, "audio.*")
+        await bot.download_file(audio_file.file_path, destination)
+    finally:
+        release_chat(message.from_user.id)
     await state.set_state(SongStates.cover)
     await bot.send_message(chat_id=message.from_user.id, text=f"Прикрепите фоновое изображение:")
 
@@ -132,80 +245,450 @@ async def attach_cover(message: types.Message, state: FSMContext):
         return
     logging.info("Получен cover file ID: %r", cover_file_id)
 
-    cover_file = await bot.get_file(cover_file_id)
-    file_extension = cover_file.file_path.rsplit(".", 1)[-1]
-    user_folder = USER_DATA / str(message.from_user.id)
-    destination = user_folder / f"cover.{file_extension}"
-    await bot.download_file(cover_file.file_path, destination)
-    await bot.send_message(
-        chat_id=message.from_user.id,
-        text=f"Спасибо за предоставленные файлы, приступаю к созданию караоке. Примерное время ожидания - 10-15 минут",
-    )
-    user_data = await state.get_data()
-    song_name: str = user_data["song_name"]
-    audio_file = next(user_folder.glob("audio.*"))
-    await make_a_video(
-        message=message,
-        song_title=song_name,
-        audio_file=audio_file,
-        cover_image_file=destination,
-    )
-    await state.clear()
+    # Чат занят с загрузки обложки до отправки видео
+    if not claim_chat(message.from_user.id):
+        await bot.send_message(chat_id=message.from_user.id, text=BUSY_TEXT)
+        return
+    try:
+        cover_file = await bot.get_file(cover_file_id)
+        file_extension = cover_file.file_path.rsplit(".", 1)[-1]
+        user_folder = USER_DATA / str(message.from_user.id)
+        destination = user_folder / f"cover.{file_extension}"
+        remove_files(user_folder, "cover.*")
+        await bot.download_file(cover_file.file_path, destination)
+        await bot.send_message(
+            chat_id=message.from_user.id,
+            text=f"Спасибо за предоставленные файлы, приступаю к созданию караоке",
+        )
+        user_data = await state.get_data()
+        song_name: str = user_data["song_name"]
+        audio_file = next(user_folder.glob("audio.*"))
+        await state.clear()
+        await make_a_video(
+            chat_id=message.from_user.id,
+            song_title=song_name,
+            audio_file=audio_file,
+            cover_image_file=destination,
+        )
+    finally:
+        release_chat(message.from_user.id)
 
 
-async def make_a_video(
-    message: types.Message, song_title: str, audio_file: Path, cover_image_file: Path
-):
-    audio_separator = SpleeterSeparator()
-    text_generator = GeniusTextScrapper()
-    voice_recognizer = WhisperRecognizer()
-    timestamp_linker = WordGrabberTextAlignmentLinker()
-    video_maker = FfmpegVideoMaker()
-    bot_message = await bot.send_message(
-        chat_id=message.from_user.id,
-        text="🔵Получение текста песни...",
-    )
-    song_text = text_generator.get_text_for_a_song(song_title=song_title)
-    await bot_message.edit_text("✅Текст песни получен")
-    bot_message = await bot.send_message(
-        chat_id=message.from_user.id,
-        text="🔵Разделение вокала и инструментала...",
-    )
-    separation_result = audio_separator.separate_into_vocals_and_music(
-        audio_file=audio_file
-    )
-    await bot_message.edit_text("✅Вокал и инструментал разделены")
-    bot_message = await bot.send_message(
-        chat_id=message.from_user.id,
-        text="🔵Получение временных меток...",
-    )
-    recognized_phrases = voice_recognizer.get_text_from_vocals(
-        vocals=separation_result.vocals
-    )
-    timestamped_phrases = timestamp_linker.link_timestamps_to_song_text(
-        full_text=song_text, phrases=recognized_phrases
-    )
-    await bot_message.edit_text("✅Временные метки получены")
-    bot_message = await bot.send_message(
-        chat_id=message.from_user.id,
-        text="🔵Отрисовка видео...",
-    )
-    video_path = video_maker.compile_video(
-        song_title=song_title,
+@dp.callback_query(F.data == "cover")
+async def change_cover(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id in active_jobs:
+        await bot.send_message(chat_id=callback.from_user.id, text=BUSY_TEXT)
+        return
+    checkpoint = await asyncio.to_thread(FileJobCheckpoint.open, USER_DATA / str(callback.from_user.id))
+    if checkpoint is None:
+        await cmd_song(callback, state)
+        return
+    # Аудио, распознанный текст и разметка берутся из чекпоинта, заново отрисовывается только видео
+    await state.update_data(song_name=checkpoint.song_title)
+    await state.set_state(SongStates.cover)
+    await bot.send_message(chat_id=callback.from_user.id, text=f"Прикрепите новое фоновое изображение:")
+
+
+@dp.callback_query(F.data == "lyrics")
+async def change_lyrics(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id in active_jobs:
+        await bot.send_message(chat_id=callback.from_user.id, text=BUSY_TEXT)
+        return
+    checkpoint = await asyncio.to_thread(FileJobCheckpoint.open, USER_DATA / str(callback.from_user.id))
+    song_text = checkpoint.load(Stage.TEXT) if checkpoint is not None else None
+    if song_text is None or checkpoint.load(Stage.LINKING) is None:
+        await cmd_song(callback, state)
+        return
+    await state.set_state(SongStates.lyrics)
+    await bot.send_message(chat_id=callback.from_user.id,
+                           text=f"Пришлите исправленный текст песни целиком, по строке на строку караоке. Текущий текст:")
+    await bot.send_message(chat_id=callback.from_user.id, text=song_text)
+
+
+@dp.message(StateFilter(SongStates.lyrics))
+async def enter_lyrics(message: types.Message, state: FSMContext):
+    chat_id = message.from_user.id
+    await state.clear()
+    if not claim_chat(chat_id):
+        await bot.send_message(chat_id=chat_id, text=BUSY_TEXT)
+        return
+    try:
+        checkpoint = await asyncio.to_thread(FileJobCheckpoint.open, USER_DATA / str(chat_id))
+        if checkpoint is None or not message.text:
+            await bot.send_message(chat_id=chat_id, text=f"Необходим текст песни")
+            return
+        job = Job(audio=checkpoint.audio, song_title=checkpoint.song_title, cover_image=checkpoint.cover_image,
+                  checkpoint=checkpoint, work_dir=checkpoint.job_dir)
+        job.listener = TelegramStageListener([chat_id], asyncio.get_running_loop())
+        if not await asyncio.to_thread(video_director.can_edit_lyrics, job):
+            await bot.send_message(chat_id=chat_id, text="Караоке ещё не создано, сначала создайте его")
+            return
+        # Разделение и распознавание не выполняются заново: их результаты берутся из чекпоинта
+        try:
+            video_path = await asyncio.to_thread(video_director.edit_lyrics, job, message.text)
+            checkpoint.mark_text_edited()
+            file_id = await send_video_to_chats([chat_id], video_path, f"{job.song_title}.mp4")
+            record_delivery(checkpoint, file_id)
+        except Exception as e:
+            logging.exception("Не удалось исправить текст караоке %r для %r", checkpoint.song_title, chat_id)
+            checkpoint.mark_failed(repr(e))
+            await bot.send_message(chat_id=chat_id, text="Не удалось создать караоке, попробуйте ещё раз")
+    finally:
+        release_chat(chat_id)
+    await send_continue_menu(chat_id)
+
+
+def claim_chat(chat_id: int) -> bool:
+    """
+    Отмечает, что файлы чата заняты задачей. False, если они уже заняты
+    """
+    if chat_id in active_jobs:
+        return False
+    active_jobs.add(chat_id)
+    metrics.set_queue_depth("jobs", len(active_jobs))
+    return True
+
+
+def release_chat(chat_id: int):
+    active_jobs.discard(chat_id)
+    metrics.set_queue_depth("jobs", len(active_jobs))
+
+
+def remove_files(folder: Path, pattern: str):
+    for path in folder.glob(pattern):
+        path.unlink()
+
+
+# Сообщения о начале и окончании стадий
+STAGE_MESSAGES: dict[Stage, tuple[str | None, str | None]] = {
+    Stage.TEXT: ("🔵Получение текста песни...", "✅Текст песни получен"),
+    Stage.SEPARATION: ("🔵Разделение вокала и инструментала...", "✅Вокал и инструментал разделены"),
+    Stage.RECOGNITION: ("🔵Получение временных меток...", None),
+    Stage.LINKING: (None, "✅Временные метки получены"),
+    Stage.PREVIEW: ("🔵Отрисовка превью...", "✅Превью готово, продолжаю отрисовку полного видео"),
+    Stage.RENDERING: ("🔵Отрисовка видео...", "✅Видео отрисовано"),
+}
+
+
+class TelegramStageListener(StageListener):
+    """
+    Сообщает подписчикам задачи о её ходе. Вызывается из потоков, в которых выполняются стадии,
+    стадии одной задачи могут выполняться одновременно
+    """
+
+    def __init__(
+            self,
+            subscribers: list[int],
+            loop: asyncio.AbstractEventLoop,
+            estimate: Callable[[], float | None] = lambda: None,
+    ):
+        self._subscribers = subscribers
+        self._loop = loop
+        self._estimate = estimate
+        self._messages: dict[tuple[int, Stage], types.Message] = {}
+
+    def on_stage_started(self, stage: Stage) -> None:
+        text = STAGE_MESSAGES[stage][0]
+        if text is None:
+            return
+        eta = self._estimate()
+        if eta is not None:
+            text += f" До готовности видео примерно {format_duration(eta)}"
+        for chat_id in list(self._subscribers):
+            message = self._call(chat_id, bot.send_message(chat_id=chat_id, text=text))
+            if message is not None:
+                self._messages[(chat_id, stage)] = message
+
+    def on_stage_finished(self, stage: Stage, result: Any) -> None:
+        text = STAGE_MESSAGES[stage][1]
+        if text is None:
+            return
+        for chat_id in list(self._subscribers):
+            message = self._pop_message(chat_id, stage)
+            if message is None:
+                self._call(chat_id, bot.send_message(chat_id=chat_id, text=text))
+            else:
+                self._call(chat_id, message.edit_text(text=text))
+        if stage == Stage.PREVIEW:
+            # Не ждём загрузки превью, полное видео отрисовывается параллельно
+            future = asyncio.run_coroutine_threadsafe(
+                send_video_to_chats(list(self._subscribers), result, "preview.mp4"), self._loop
+            )
+            future.add_done_callback(log_preview_error)
+
+    def _pop_message(self, chat_id: int, stage: Stage) -> types.Message | None:
+        """
+        Сообщение о начале стадии. Если у стадии его нет, то сообщение зависимости,
+        окончание которой не сообщалось отдельно (распознавание заканчивается вместе с разметкой)
+        """
+        message = self._messages.pop((chat_id, stage), None)
+        for dependency in STAGE_DEPENDENCIES[stage]:
+            if message is None and STAGE_MESSAGES[dependency][1] is None:
+                message = self._messages.pop((chat_id, dependency), None)
+        return message
+
+    def _call(self, chat_id: int, coroutine) -> Any:
+        """
+        Сообщение о ходе задачи не должно срывать стадию: если пользователь заблокировал бота или удалил чат,
+        общая задача продолжается для остальных подписчиков
+        """
+        try:
+            return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+        except TelegramAPIError as e:
+            logging.warning("Не удалось сообщить чату %r о ходе задачи: %r", chat_id, e)
+            return None
+
+
+def log_preview_error(future: concurrent.futures.Future):
+    # concurrent.futures не сообщает о необработанных исключениях, без этого ошибка отправки превью потеряется
+    if not future.cancelled() and future.exception() is not None:
+        logging.error("Не удалось отправить превью", exc_info=future.exception())
+
+
+def format_duration(seconds: float) -> str:
+    return f"{max(round(seconds / 60), 1)} мин."
+
+
+async def send_video_to_chats(chat_ids: list[int], video_path: Path, filename: str) -> str:
+    """
+    Загружает видео в Telegram один раз, остальным чатам отправляет его по file_id.
+    Чаты, добавленные в список во время отправки, тоже получат видео. Если в какой-то чат отправить не удалось
+    (например, пользователь заблокировал бота), остальные чаты всё равно получат видео
+    """
+    file_id = None
+    error = None
+    sent = 0
+    while sent < len(chat_ids):
+        chat_id = chat_ids[sent]
+        sent += 1
+        video = file_id or FSInputFile(path=video_path, filename=filename)
+        try:
+            message = await bot.send_video(chat_id=chat_id, video=video)
+        except TelegramAPIError as e:
+            logging.warning("Не удалось отправить видео в чат %r: %r", chat_id, e)
+            error = e
+            continue
+        file_id = file_id or message.video.file_id
+    if file_id is None:
+        raise error
+    return file_id
+
+
+async def make_a_video(chat_id: int, song_title: str, audio_file: Path, cover_image_file: Path):
+    # Чекпоинт хеширует входные файлы, это не должно останавливать цикл событий
+    checkpoint = await asyncio.to_thread(
+        FileJobCheckpoint, USER_DATA / str(chat_id), audio=audio_file, song_title=song_title,
         cover_image=cover_image_file,
-        back_track=separation_result.back_track,
-        timestamped_phrases=timestamped_phrases,
     )
-    await bot_message.edit_text(text="✅Видео отрисовано")
-    video_file = FSInputFile(path=video_path, filename=f"{song_title}.mp4")
-    await bot.send_video(chat_id=message.from_user.id, video=video_file)
+    await run_job(chat_id, checkpoint)
+
+
+def render_key(checkpoint: FileJobCheckpoint) -> str:
+    """
+    Одинаковый для задач с одинаковыми входными данными и текстом песни, пока не меняются настройки отрисовки
+    """
+    text_key = checkpoint.edited_text_key or ""
+    return hashlib.sha256(f"{checkpoint.job_key}:{text_key}:{video_maker.settings_key()}".encode()).hexdigest()
+
+
+async def send_delivered(chat_id: int, key: str) -> bool:
+    """
+    Отправляет по file_id уже доставленное видео. False, если такого видео не было или file_id больше не действует
+    """
+    file_id = delivered_videos.get(key)
+    metrics.record_cache("file_id", hit=file_id is not None)
+    if file_id is None:
+        return False
+    try:
+        await bot.send_video(chat_id=chat_id, video=file_id)
+    except TelegramBadRequest:
+        logging.warning("file_id видео %s больше не действует", key)
+        delivered_videos.discard(key)
+        return False
+    return True
+
+
+def record_delivery(checkpoint: FileJobCheckpoint, file_id: str):
+    delivered_videos.put(render_key(checkpoint), file_id)
+    # Видео отправляется по file_id, но последнее видео задачи нужно для перерисовки только изменённых участков.
+    # Превью не удаляем: оно может ещё загружаться, и весит оно немного
+    if EVICT_DELIVERED_VIDEOS:
+        checkpoint.evict(Stage.RENDERING)
+
+
+async def run_job(chat_id: int, checkpoint: FileJobCheckpoint):
+    """
+    Создаёт и отправляет видео. Чат должен быть занят задачей (claim_chat)
+    """
+    checkpoint.mark_started()
+    try:
+        # Такое видео уже отправлялось: ни отрисовки, ни загрузки
+        if await send_delivered(chat_id, render_key(checkpoint)):
+            checkpoint.mark_finished()
+            await send_continue_menu(chat_id)
+            return
+        # Одинаковые задачи (то же аудио, название, обложка и текст) выполняются один раз
+        key = render_key(checkpoint)
+        attached = key in video_jobs
+        metrics.record_cache("single_flight", hit=attached)
+        if attached:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="Такое же караоке уже создаётся, пришлю его, как только оно будет готово",
+            )
+        source = await video_jobs.run(key, chat_id, lambda flight: render_and_send(flight, checkpoint))
+        if source is not checkpoint:
+            # Видео создала задача другого чата: её результаты нужны, чтобы сменить обложку или исправить текст
+            await asyncio.to_thread(copy_stages, source, checkpoint)
+    except Exception as e:
+        logging.exception("Не удалось создать караоке %r для %r", checkpoint.song_title, chat_id)
+        checkpoint.mark_failed(repr(e))
+        await bot.send_message(chat_id=chat_id, text="Не удалось создать караоке, попробуйте ещё раз")
+        return
+    checkpoint.mark_finished()
+    await send_continue_menu(chat_id)
+
+
+async def send_continue_menu(chat_id: int):
     builder = InlineKeyboardBuilder()
     builder.row(types.InlineKeyboardButton(text="Создать караоке", callback_data="song"))
-    await bot.send_message(chat_id=message.from_user.id, text="Продолжим?", reply_markup=builder.as_markup())
+    builder.row(types.InlineKeyboardButton(text="Сменить обложку", callback_data="cover"))
+    builder.row(types.InlineKeyboardButton(text="Исправить текст", callback_data="lyrics"))
+    await bot.send_message(chat_id=chat_id, text="Продолжим?", reply_markup=builder.as_markup())
+
+
+async def render_and_send(flight: Flight[int], checkpoint: FileJobCheckpoint) -> FileJobCheckpoint:
+    leader = flight.subscribers[0]
+    job = Job(
+        audio=checkpoint.audio,
+        song_title=checkpoint.song_title,
+        cover_image=checkpoint.cover_image,
+        checkpoint=checkpoint,
+        profile_stages=PROFILE_STAGES | profile_requests.pop(leader, frozenset()),
+        profile_dir=checkpoint.job_dir / "profiles",
+        audio_duration=await asyncio.to_thread(probe_duration, checkpoint.audio),
+        work_dir=checkpoint.job_dir,
+    )
+    job.listener = TelegramStageListener(
+        flight.subscribers, asyncio.get_running_loop(), estimate=lambda: scheduler.estimate(job)
+    )
+    if broker is not None:
+        video_path = await run_on_broker(job, checkpoint)
+    else:
+        eta = await asyncio.to_thread(scheduler.estimate, job)
+        if eta is not None:
+            await bot.send_message(chat_id=leader, text=f"Примерное время ожидания - {format_duration(eta)}")
+        video_path = await asyncio.wrap_future(scheduler.submit(job))
+    file_id = await send_video_to_chats(flight.subscribers, video_path, f"{job.song_title}.mp4")
+    record_delivery(checkpoint, file_id)
+    return checkpoint
+
+
+def copy_stages(source: FileJobCheckpoint, checkpoint: FileJobCheckpoint):
+    """
+    Переносит выполненные стадии из задачи с теми же входными данными
+    """
+    for stage in video_director.stages:
+        if checkpoint.load(stage) is not None or source.load(stage) is None:
+            continue
+        try:
+            with tempfile.TemporaryDirectory(dir=checkpoint.job_dir) as exported:
+                source.export_stage(stage, Path(exported))
+                checkpoint.import_stage(stage, Path(exported))
+        except (OSError, SerializationError):
+            # Пользователь исходной задачи мог уже сменить её файлы, стадия просто выполнится заново
+            logging.warning("Не удалось перенести стадию %s в %s", stage.value, checkpoint.job_dir, exc_info=True)
+
+
+async def run_on_broker(job: Job, checkpoint: FileJobCheckpoint) -> VideoPath:
+    """
+    Отдаёт задачу исполнителям брокера и ждёт её окончания. Уже сохранённые в чекпоинте стадии
+    передаются брокеру готовыми, а результаты выполненных исполнителями стадий переносятся в чекпоинт
+    """
+    stages = video_director.stages
+    job_id = render_key(checkpoint)
+    with tempfile.TemporaryDirectory() as exported:
+        completed = {}
+        for stage in stages:
+            if checkpoint.load(stage) is not None:
+                completed[stage] = Path(exported) / stage.value
+                await asyncio.to_thread(checkpoint.export_stage, stage, completed[stage])
+        inputs = JobInputs(job.audio, job.song_title, job.cover_image)
+        await asyncio.to_thread(broker.submit, job_id, inputs, stages, completed)
+
+    eta = await asyncio.to_thread(scheduler.estimate, job)
+    timeout = max(BROKER_MIN_TIMEOUT_SECONDS, BROKER_TIMEOUT_FACTOR * eta if eta is not None else 0)
+    deadline = time.monotonic() + timeout
+    started: set[Stage] = set()
+    while True:
+        status = await asyncio.to_thread(broker.status, job_id)
+        for stage, task_state in status.items():
+            if task_state == TaskState.LEASED and stage not in started:
+                started.add(stage)
+                # Слушатель ждёт отправки сообщений в цикле событий, поэтому вызывается из другого потока
+                await asyncio.to_thread(job.listener.on_stage_started, stage)
+            elif task_state == TaskState.DONE and checkpoint.load(stage) is None:
+                result = await asyncio.to_thread(import_from_broker, job_id, checkpoint, stage)
+                await asyncio.to_thread(job.listener.on_stage_finished, stage, result)
+        if TaskState.FAILED in status.values():
+            error = await asyncio.to_thread(broker.error, job_id)
+            raise RenderingError(error or "Задача не выполнена")
+        if status and all(task_state == TaskState.DONE for task_state in status.values()):
+            return checkpoint.load(stages[-1])
+        if time.monotonic() > deadline:
+            raise RenderingError(f"Исполнители не выполнили задачу за {format_duration(timeout)}")
+        await asyncio.sleep(BROKER_POLL_SECONDS)
+
+
+def import_from_broker(job_id: str, checkpoint: FileJobCheckpoint, stage: Stage):
+    with tempfile.TemporaryDirectory() as artifacts:
+        broker.fetch_artifacts(job_id, stage, Path(artifacts))
+        checkpoint.import_stage(stage, Path(artifacts))
+    return checkpoint.load(stage)
+
+
+async def resume_unfinished_jobs():
+    """
+    Продолжает задачи, прерванные перезапуском бота, с последней завершённой стадии.
+    Задачи, которые ещё не запускались (пользователь не прислал обложку) или завершились ошибкой, пропускаются
+    """
+    for user_folder in USER_DATA.iterdir():
+        if not user_folder.is_dir() or not user_folder.name.isdigit():
+            continue
+        checkpoint = await asyncio.to_thread(FileJobCheckpoint.open, user_folder)
+        if checkpoint is None or checkpoint.is_finished or checkpoint.attempts == 0 or checkpoint.error is not None:
+            continue
+        chat_id = int(user_folder.name)
+        if checkpoint.attempts >= MAX_JOB_ATTEMPTS:
+            logging.error("Задача %r для %r прервана %d раз, не возобновляется",
+                          checkpoint.song_title, chat_id, checkpoint.attempts)
+            checkpoint.mark_failed("Задача прервана перезапусками бота")
+            try:
+                await bot.send_message(chat_id=chat_id, text="Не удалось создать караоке, попробуйте ещё раз")
+            except TelegramAPIError as e:
+                # Ошибка отправки одному пользователю не должна мешать возобновить задачи остальных
+                logging.warning("Не удалось сообщить об ошибке в чат %r: %r", chat_id, e)
+            continue
+        logging.info("Возобновление задачи %r для %r", checkpoint.song_title, chat_id)
+        claim_chat(chat_id)
+        task = asyncio.create_task(resume_job(chat_id, checkpoint))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def resume_job(chat_id: int, checkpoint: FileJobCheckpoint):
+    try:
+        await bot.send_message(chat_id=chat_id, text=f"Бот был перезапущен, продолжаю создание караоке")
+        await run_job(chat_id, checkpoint)
+    finally:
+        release_chat(chat_id)
 
 
 async def main():
     USER_DATA.mkdir(exist_ok=True)
+    if METRICS_PORT:
+        metrics.serve(int(METRICS_PORT))
+    await resume_unfinished_jobs()
     await dp.start_polling(bot)
 
 
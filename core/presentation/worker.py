@@ -0,0 +1,155 @@
+"""
+Исполнитель стадий, получаемых через брокер. Запускается на любом числе машин с доступом к папке брокера.
+
+    uv run python -m core.presentation.worker BROKER_DIR [--work-dir worker_data]
+        [--resources separation,recognition,cpu] [--inference-socket SOCKET]
+
+Модели загружаются один раз. Исполнитель берёт в аренду стадию одного из своих ресурсов,
+получает результаты стадий, от которых она зависит, выполняет её и возвращает результаты брокеру.
+Пока стадия выполняется, аренда продлевается; если исполнитель упадёт, стадию получит другой.
+С --inference-socket модели не загружаются, а берутся у сервера моделей (core.presentation.inference_server),
+поэтому на одной машине можно запустить несколько исполнителей
+"""
+import argparse
+import logging
+import socket
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+from core.application.broker import Broker, LeasedTask
+from core.application.cost_model import CostModel
+from core.application.exceptions import LeaseLostError
+from core.application.job import Job, Stage, STAGE_DEPENDENCIES
+from core.application.scheduler import Resource, STAGE_RESOURCES
+from core.application.video_director import VideoDirector
+from core.infrastructure.broker.sqlite_broker import SqliteBroker
+from core.infrastructure.checkpoint.file_checkpoint import FileJobCheckpoint
+from core.infrastructure.inference.remote import RemoteRecognizer, RemoteSeparator
+from core.infrastructure.media.ffprobe import probe_duration
+from core.infrastructure.metrics.prometheus import PrometheusMetrics
+from core.infrastructure.separation.spleeter_ai import SpleeterSeparator
+from core.infrastructure.text_generation.genius import GeniusTextScrapper
+from core.infrastructure.timing_history.jsonl_history import JsonlTimingHistory
+from core.infrastructure.timestamp_linking.per_word_alignment_linking import WordGrabberTextAlignmentLinker
+from core.infrastructure.video_maker.ffmpeg_video_maker import FfmpegVideoMaker
+from core.infrastructure.voice_recognition.whisper_ai import WhisperRecognizer
+
+WORK_FOLDER = Path("worker_data")
+TIMING_HISTORY_NAME = "stage_timings.jsonl"
+LEASE_SECONDS = 60.0
+POLL_SECONDS = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class StageWorker:
+    def __init__(
+            self,
+            broker: Broker,
+            director: VideoDirector,
+            work_dir: Path,
+            stages: frozenset[Stage],
+            worker_id: str,
+            lease_seconds: float = LEASE_SECONDS,
+    ):
+        self.broker = broker
+        self.director = director
+        self.work_dir = work_dir
+        self.stages = stages
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+
+    def run(self, stop: threading.Event, poll_seconds: float = POLL_SECONDS):
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(poll_seconds)
+
+    def run_once(self) -> bool:
+        """
+        Выполняет одну стадию. False, если готовых стадий нет
+        """
+        task = self.broker.lease(self.worker_id, self.stages, self.lease_seconds)
+        if task is None:
+            return False
+        logger.info("Стадия %s задачи %s, попытка %d", task.stage.value, task.job_id, task.attempt)
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, finished), daemon=True)
+        heartbeat.start()
+        try:
+            self.execute(task)
+        except LeaseLostError:
+            logger.warning("Аренда стадии %s задачи %s потеряна", task.stage.value, task.job_id)
+        except Exception as e:
+            logger.exception("Стадия %s задачи %s не выполнена", task.stage.value, task.job_id)
+            self.broker.fail(task, self.worker_id, repr(e))
+        finally:
+            finished.set()
+            heartbeat.join()
+        return True
+
+    def execute(self, task: LeasedTask):
+        inputs = task.inputs
+        # Папка задачи на исполнителе сохраняется между стадиями: результаты, полученные ранее, не скачиваются заново
+        checkpoint = FileJobCheckpoint(self.work_dir / task.job_id, audio=inputs.audio, song_title=inputs.song_title,
+                                       cover_image=inputs.cover_image)
+        for dependency in STAGE_DEPENDENCIES[task.stage]:
+            if checkpoint.load(dependency) is None:
+                with tempfile.TemporaryDirectory() as artifacts:
+                    self.broker.fetch_artifacts(task.job_id, dependency, Path(artifacts))
+                    checkpoint.import_stage(dependency, Path(artifacts))
+        job = Job(audio=inputs.audio, song_title=inputs.song_title, cover_image=inputs.cover_image,
+                  checkpoint=checkpoint, audio_duration=probe_duration(inputs.audio), work_dir=checkpoint.job_dir)
+        self.director.run_stage(job, task.stage)
+        with tempfile.TemporaryDirectory() as artifacts:
+            checkpoint.export_stage(task.stage, Path(artifacts) / task.stage.value)
+            self.broker.complete(task, self.worker_id, Path(artifacts) / task.stage.value)
+
+    def _heartbeat(self, task: LeasedTask, finished: threading.Event):
+        while not finished.wait(self.lease_seconds / 3):
+            if not self.broker.heartbeat(task, self.worker_id, self.lease_seconds):
+                return
+
+
+def parse_resources(value: str) -> frozenset[Resource]:
+    return frozenset(Resource(name.strip()) for name in value.split(",") if name.strip())
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("broker", type=Path, help="Папка брокера")
+    parser.add_argument("--work-dir", type=Path, default=WORK_FOLDER)
+    parser.add_argument("--resources", type=parse_resources, default=frozenset(Resource),
+                        help="Стадии каких ресурсов выполнять: network, separation, recognition, cpu через запятую")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--inference-socket", type=Path, help="Сокет сервера моделей")
+    args = parser.parse_args()
+
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    metrics = PrometheusMetrics()
+    remote = args.inference_socket is not None
+    director = VideoDirector(
+        audio_separator=RemoteSeparator(args.inference_socket) if remote else SpleeterSeparator(),
+        text_generator=GeniusTextScrapper(),
+        voice_recognizer=RemoteRecognizer(args.inference_socket) if remote else WhisperRecognizer(),
+        timestamp_linker=WordGrabberTextAlignmentLinker(),
+        video_maker=FfmpegVideoMaker(metrics=metrics),
+        preview_maker=FfmpegVideoMaker.preview(metrics=metrics),
+        metrics=metrics,
+        cost_model=CostModel(JsonlTimingHistory(args.work_dir / TIMING_HISTORY_NAME)),
+    )
+    stages = frozenset(stage for stage, resource in STAGE_RESOURCES.items() if resource in args.resources)
+    worker = StageWorker(SqliteBroker(args.broker), director, args.work_dir, stages, args.worker_id,
+                         args.lease_seconds)
+    logger.info("Исполнитель %s, стадии: %s", args.worker_id, ", ".join(sorted(stage.value for stage in stages)))
+    try:
+        worker.run(threading.Event())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()